@@ -0,0 +1,876 @@
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+import http_cache
+import query_acs
+import query_tiger
+import r_split_2020
+import impute
+import ridge
+import nyt_precinct
+from live_results import live_results
+from compact_results import compact_results
+from ddhq_scrape_county_returns import ddhq_scrape, scrape_states, write_results
+from stand_in import get_county_names, make_ddhq_state_json, make_precinct_geojson, payload_server
+
+
+#####################################################################################
+###########################     Synthetic Payloads     ##############################
+#####################################################################################
+
+bench_states = [
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'ID', 'IL',
+    'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT',
+    'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA', 'RI',
+    'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY']
+
+def make_acs_variables_json(groups=['DP02', 'DP03', 'DP04', 'DP05'], n_vars=150):
+    """ Build a synthetic ACS profile variables.json
+
+        Each group has estimate (E), margin (M), percent (PE) and percent margin
+        (PM) variables, plus the for/in geography pseudo variables, which have
+        no concept or predicateType.
+
+    Returns:
+        dict with variable metadata stored under variables
+    """
+    variables = {'for': {'label': "Census API FIPS 'for' clause", 'predicateOnly': True},
+                 'in': {'label': "Census API FIPS 'in' clause", 'predicateOnly': True},
+                 'GEO_ID': {'label': 'Geography', 'concept': 'Geography',
+                            'predicateType': 'string', 'group': 'N/A'}}
+    for group in groups:
+        concept = 'SELECTED CHARACTERISTICS ' + group
+        for i in range(1, n_vars + 1):
+            for suffix, prefix in [('E', 'Estimate'), ('M', 'Margin of Error'),
+                                   ('PE', 'Percent'), ('PM', 'Percent Margin of Error')]:
+                variables['{}_{:04d}{}'.format(group, i, suffix)] = {
+                    'label': prefix + '!!' + group + ' item ' + str(i),
+                    'concept': concept,
+                    'predicateType': 'int' if suffix == 'E' else 'float',
+                    'group': group}
+    return {'variables': variables}
+
+
+def make_acs_response(acs_vars, n_geos=3221, seed=0, fips=None):
+    """ Build a synthetic ACS API response for county level variables
+
+        Percent variables are mostly between 0 and 100, with some missing and
+        some Census annotation values (ex: -888888888). Other variables are counts.
+
+    Args:
+        acs_vars (list of str) variables in the get param, may include GEO_ID
+        n_geos   (int) counties to return
+        fips     (list of str) county fips codes to return instead of n_geos
+                 made up ones
+
+    Returns:
+        list of rows, the first holding column names
+    """
+    rng = random.Random(seed)
+    header = list(acs_vars) + ['state', 'county']
+    rows = [header]
+    if fips is None:
+        fips = ['{:02d}{:03d}'.format(n // 100 + 1, n % 100 + 1) for n in range(n_geos)]
+    for geo in fips:
+        state, county = geo[:2], geo[2:]
+        row = []
+        for var in acs_vars:
+            if var == 'GEO_ID':
+                row.append('0500000US' + state + county)
+            elif rng.random() < 0.02:
+                row.append(None)
+            elif var.endswith('PE') and rng.random() > 0.01:
+                row.append(str(round(rng.uniform(0, 100), 1)))
+            elif var.endswith('PE'):
+                row.append('-888888888')
+            else:
+                row.append(str(rng.randint(0, 100000)))
+        rows.append(row + [state, county])
+    return rows
+
+
+def make_tiger_zip(state_fips, geography='TRACT', year='2020', n_shapes=1000):
+    """ Build a synthetic TIGER shapefile zip of square shapes for one state
+
+    Returns:
+        bytes of the zip file
+    """
+    file_name = 'tl_{}_{}_{}'.format(year, state_fips, geography.lower())
+    x0 = int(state_fips) * 2
+    shapes = gpd.GeoDataFrame(
+        {'STATEFP': state_fips,
+         'GEOID': ['{}{:09d}'.format(state_fips, n) for n in range(n_shapes)],
+         'NAMELSAD': ['Tract ' + str(n) for n in range(n_shapes)],
+         'ALAND': 1000},
+        geometry=[shapely.box(x0 + (n % 40) * 0.05, (n // 40) * 0.05,
+                              x0 + (n % 40 + 1) * 0.05, (n // 40 + 1) * 0.05)
+                  for n in range(n_shapes)],
+        crs='EPSG:4269')
+    buf = io.BytesIO()
+    with tempfile.TemporaryDirectory() as tmp, zipfile.ZipFile(buf, 'w') as zf:
+        shapes.to_file(os.path.join(tmp, file_name + '.shp'))
+        for part in os.listdir(tmp):
+            zf.write(os.path.join(tmp, part), part)
+    return buf.getvalue()
+
+def make_tiger_listing(zip_names):
+    """ Build a census.gov style directory listing of zip_names
+    """
+    rows = ''.join('<tr><td>{}</td><td>1M</td></tr>'.format(name) for name in zip_names)
+    return '<table><tr><th>Name</th><th>Size</th></tr>' + rows + '</table>'
+
+
+#####################################################################################
+############################     Stand-in Server     ################################
+#####################################################################################
+
+
+#####################################################################################
+###############################     Benchmarks     ##################################
+#####################################################################################
+
+def bench_ddhq_parse(states=bench_states, n_counties=80, n_races=4, n_cands=3):
+    """ Time building counties, candidates and votes tables for synthetic states
+
+    Returns:
+        pandas.DataFrame with columns state, vote_rows, seconds
+    """
+    timings = []
+    for i, state in enumerate(states):
+        scrape = ddhq_scrape()
+        scrape.state_json = make_ddhq_state_json(state, n_counties, n_races, n_cands, seed=i)['data']
+        start = time.perf_counter()
+        scrape.set_tbls(state)
+        timings.append([state, len(scrape.votes_tbl), time.perf_counter() - start])
+    return pd.DataFrame(timings, columns=['state', 'vote_rows', 'seconds'])
+
+def bench_ddhq_fetch(states=bench_states, workers=8, latency=0.2, n_counties=80):
+    """ Time scrape_states against the stand-in server
+
+        latency simulates the round trip to embeds.ddhq.io for each state.
+        Responses are cached in an empty temporary directory.
+
+    Returns:
+        tuple of (pandas.DataFrame of results, seconds)
+    """
+    payloads = {'/2020general_' + state.lower(): make_ddhq_state_json(state, n_counties, seed=i)
+                for i, state in enumerate(states)}
+    with payload_server(payloads, latency=latency) as server, \
+         tempfile.TemporaryDirectory() as cache_path:
+        http_cache.set_cache(http_cache.response_cache(path=cache_path))
+        start = time.perf_counter()
+        results = scrape_states(states, workers=workers, base_url=server.url + '/2020general_')
+        seconds = time.perf_counter() - start
+        http_cache.set_cache(None)
+    return results, seconds
+
+def sqldf_results_tbl(scrape):
+    """ The previous pandasql join for set_ddhq_results_tbl, kept for comparison
+    """
+    import pandasql as ps
+    votes_tbl = scrape.votes_tbl
+    counties_tbl = scrape.counties_tbl
+    candidates_tbl = scrape.candidates_tbl
+    return ps.sqldf("""
+        SELECT
+          cand.state_code
+        , county.fips
+        , county.county_name
+        , cand.party_name
+        , cand.first_name
+        , cand.last_name
+        , cand.office
+        , cand.incumbent
+        , vote.votes
+        FROM votes_tbl vote
+        INNER JOIN counties_tbl county ON vote.ddhq_county_id = county.ddhq_county_id
+        INNER JOIN candidates_tbl cand ON vote.race_id = cand.race_id AND vote.cand_id = cand.cand_id
+        """,
+        locals())
+
+def bench_ddhq_join(states=['TX', 'ME', 'MA', 'NH', 'VT'], n_towns=600, n_races=40, n_cands=4):
+    """ Time the results join against the previous sqldf join on large states
+
+        Texas and the New England states report results by town under vcuResults.
+
+    Returns:
+        pandas.DataFrame with columns state, result_rows, join_seconds, sqldf_seconds
+    """
+    timings = []
+    for i, state in enumerate(states):
+        scrape = ddhq_scrape()
+        scrape.state_json = make_ddhq_state_json(state, n_towns, n_races, n_cands,
+                                                 vcu=True, seed=i)['data']
+        scrape.set_tbls(state)
+        start = time.perf_counter()
+        scrape.set_ddhq_results_tbl(state)
+        join_seconds = time.perf_counter() - start
+        try:
+            start = time.perf_counter()
+            sqldf_results_tbl(scrape)
+            sqldf_seconds = time.perf_counter() - start
+        except ImportError:
+            sqldf_seconds = None
+        timings.append([state, len(scrape.ddhq_results_tbl), join_seconds, sqldf_seconds])
+    return pd.DataFrame(timings, columns=['state', 'result_rows', 'join_seconds', 'sqldf_seconds'])
+
+def make_results_file(file_name, states=bench_states, n_races=4, n_cands=3):
+    """ Write a synthetic nationwide county results file with every county of each state
+
+    Returns:
+        file_name
+    """
+    state_results = []
+    for i, state in enumerate(states):
+        scrape = ddhq_scrape()
+        n_counties = len(get_county_names(state)) or 80
+        scrape.state_json = make_ddhq_state_json(state, n_counties, n_races, n_cands, seed=i)['data']
+        scrape.set_ddhq_results_tbl(state)
+        state_results.append(scrape.ddhq_results_tbl)
+    ddhq_results = pd.concat(state_results, axis=0, ignore_index=True)
+    ddhq_results['datestamp'] = '20201103'
+    write_results(ddhq_results, file_name)
+    return file_name
+
+def legacy_party_votes_pe(file_name):
+    """ The previous get_party_votes_pe, reading the file twice and merging pivots
+    """
+    df = r_split_2020.get_party_votes(file_name).merge(
+        r_split_2020.get_all_county_votes(file_name))
+    df['d_pres_pe']  = df['Democratic President'] / df['votes President']
+    df['r_pres_pe']  = df['Republican President'] / df['votes President']
+    df['d_house_pe'] = df['Democratic US House']  / df['votes US House']
+    df['r_house_pe'] = df['Republican US House']  / df['votes US House']
+    df = df.filter(['fips', 'd_pres_pe', 'r_pres_pe', 'd_house_pe', 'r_house_pe'])
+    return df.dropna(axis=0)
+
+def bench_party_votes(file_name):
+    """ Time get_party_votes_pe against the previous pivot and merge version
+
+    Returns:
+        dict with counties, seconds, legacy_seconds, max_diff
+    """
+    start = time.perf_counter()
+    pe = r_split_2020.get_party_votes_pe(file_name)
+    seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    legacy = legacy_party_votes_pe(file_name)
+    legacy_seconds = time.perf_counter() - start
+    both = pe.merge(legacy, on='fips', suffixes=('', '_legacy'))
+    max_diff = max((both[col] - both[col + '_legacy']).abs().max()
+                   for col in ['d_pres_pe', 'r_pres_pe', 'd_house_pe', 'r_house_pe'])
+    return {'counties': len(pe), 'seconds': seconds, 'legacy_seconds': legacy_seconds,
+            'max_diff': max_diff}
+
+def bench_compact_results(file_name, cycles=['20161108', '20181106', '20201103']):
+    """ Compare holding several cycles of results as frames and as compact_results
+
+        Each cycle is a copy of the results file read with object strings, the
+        way ddhq_scrape_county_returns.py builds it.
+
+    Returns:
+        dict with rows, frame_mb, compact_mb, encode_seconds, and seconds to
+        aggregate_party_votes one cycle from the frame and the compact results
+    """
+    frame = pd.read_json(file_name, dtype={'fips': 'object'})
+    frames = [frame.assign(datestamp=cycle) for cycle in cycles]
+    frame_mb = float(sum(df.memory_usage(deep=True).sum() for df in frames)) / 1e6
+    start = time.perf_counter()
+    results = compact_results.concat([compact_results.from_frame(df) for df in frames])
+    encode_seconds = time.perf_counter() - start
+    cycle = results.get_cycle(cycles[-1])
+    start = time.perf_counter()
+    r_split_2020.aggregate_party_votes(frame)
+    frame_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    r_split_2020.aggregate_party_votes(cycle)
+    compact_seconds = time.perf_counter() - start
+    return {'rows': len(results), 'frame_mb': frame_mb, 'compact_mb': results.nbytes / 1e6,
+            'encode_seconds': encode_seconds, 'frame_seconds': frame_seconds,
+            'compact_seconds': compact_seconds}
+
+def bench_live_results(states=bench_states, n_races=4, n_cands=3, n_changed=20, seed=0):
+    """ Time a live_results poll after a few counties report against a full rescrape
+
+        Every state is polled once, then n_changed counties of one state get
+        more votes and the states are polled again. The full refresh scrapes
+        every state and recomputes get_party_votes_pe from the results file.
+
+    Returns:
+        dict with counties, first_poll_seconds, idle_poll_seconds, delta_poll_seconds,
+        full_seconds, changed_counties and max_diff against the full refresh
+    """
+    rng = random.Random(seed)
+    payloads = {'/2020general_' + state.lower():
+                make_ddhq_state_json(state, len(get_county_names(state)) or 80, n_races,
+                                     n_cands, seed=i)
+                for i, state in enumerate(states)}
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp, payload_server(payloads) as server:
+        http_cache.set_cache(http_cache.response_cache(path=os.path.join(tmp, 'http')))
+        base_url = server.url + '/2020general_'
+        live = live_results(states, base_url=base_url)
+        for name in ['first_poll_seconds', 'idle_poll_seconds']:
+            start = time.perf_counter()
+            live.poll()
+            timings[name] = time.perf_counter() - start
+
+        path = '/2020general_' + states[0].lower()
+        payload = json.loads(json.dumps(payloads[path]))
+        race = next(race for race in payload['data'] if race['office'] == 'President')
+        for county in rng.sample(race['countyResults']['counties'], n_changed):
+            for cand_id in county['votes']:
+                county['votes'][cand_id] += rng.randint(0, 1000)
+        server.payloads[path] = payload
+        start = time.perf_counter()
+        _, delta = live.poll()
+        timings['delta_poll_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        file_name = os.path.join(tmp, 'results.parquet')
+        write_results(scrape_states(states, base_url=base_url).assign(datestamp='20201103'),
+                      file_name)
+        full = r_split_2020.get_party_votes_pe(file_name)
+        timings['full_seconds'] = time.perf_counter() - start
+        http_cache.set_cache(None)
+    both = full.merge(live.get_party_votes_pe(), on='fips', suffixes=('', '_live'))
+    timings['counties'] = len(full)
+    timings['changed_counties'] = len(delta)
+    timings['max_diff'] = float(max((both[col] - both[col + '_live']).abs().max()
+                                    for col in ['d_pres_pe', 'r_pres_pe', 'd_house_pe',
+                                                'r_house_pe', 'r_pe_split']))
+    return timings
+
+def make_county_features(n_counties=3100, n_features=600, missing=0.05, seed=0):
+    """ Synthetic county ACS percentages with missing values
+
+    Returns:
+        pandas.DataFrame indexed by fips
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.uniform(0, 100, (n_counties, n_features)).astype(np.float32)
+    X[rng.random(X.shape) < missing] = np.nan
+    return pd.DataFrame(X, index=pd.Index(['{:05d}'.format(1001 + i) for i in range(n_counties)],
+                                          name='fips'),
+                        columns=['DP0{}_{:04d}PE'.format(2 + i % 4, i) for i in range(n_features)])
+
+def bench_precinct_read(n_precincts=170000, vertices=40):
+    """ Time nyt_precinct.read_precinct_results against geopandas.read_file
+
+        The synthetic file is gzipped like the NYT download, and read_file
+        reads it through GDAL's /vsigzip/.
+
+    Returns:
+        dict with precincts, attribute_seconds, attribute_peak_mb,
+        geometry_seconds, read_file_seconds and same_rows
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        file_name = make_precinct_geojson(os.path.join(tmp, 'precincts-with-results.geojson.gz'),
+                                          n_precincts, vertices)
+        tracemalloc.start()
+        start = time.perf_counter()
+        attributes = nyt_precinct.read_precinct_results(file_name)
+        attribute_seconds = time.perf_counter() - start
+        attribute_peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        start = time.perf_counter()
+        nyt_precinct.read_precinct_results(file_name, geometry=True)
+        geometry_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        reference = gpd.read_file('/vsigzip/' + file_name)
+        read_file_seconds = time.perf_counter() - start
+    same_rows = attributes.astype(str).equals(
+        pd.DataFrame(reference[nyt_precinct.precinct_columns]).astype(str))
+    return {'precincts': len(attributes), 'attribute_seconds': attribute_seconds,
+            'attribute_peak_mb': attribute_peak_mb, 'geometry_seconds': geometry_seconds,
+            'read_file_seconds': read_file_seconds, 'same_rows': same_rows}
+
+def bench_grouped_fit(n_precincts=50000, n_counties=3100, n_features=600, seed=0):
+    """ Compare fitting precincts on the merged table with fit_grouped_ridge
+
+        Both fits use a mean imputer and a single alpha, so the precinct level
+        KNN imputation the merged table would need does not dominate.
+
+    Returns:
+        dict of seconds and traced peak memory (MB) for each path, and the
+        largest coefficient difference between them
+    """
+    from sklearn.impute import SimpleImputer
+    from sklearn.linear_model import RidgeCV
+    from sklearn.pipeline import Pipeline
+    rng = np.random.default_rng(seed)
+    X_county = make_county_features(n_counties, n_features, seed=seed)
+    county_idx = rng.integers(0, n_counties, n_precincts)
+    beta = rng.normal(0, 0.001, n_features)
+    y = pd.Series(np.nan_to_num(X_county.to_numpy())[county_idx] @ beta
+                  + rng.normal(0, 0.1, n_precincts))
+    alphas = [1000.0]
+    timings = {}
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    precincts = pd.DataFrame({'fips': X_county.index[county_idx], 'y': y})
+    modeling_df = precincts.merge(X_county.reset_index())
+    merged = Pipeline([('imputer', SimpleImputer()), ('ridge', RidgeCV(alphas))])
+    merged.fit(modeling_df.drop(['fips', 'y'], axis=1), modeling_df['y'])
+    timings['merged_seconds'] = time.perf_counter() - start
+    timings['merged_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    del modeling_df
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    grouped = nyt_precinct.fit_grouped_ridge(X_county, county_idx, y, alphas,
+                                             imputer=SimpleImputer())
+    timings['grouped_seconds'] = time.perf_counter() - start
+    timings['grouped_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    timings['max_coef_diff'] = float(np.abs(merged.named_steps.ridge.coef_ -
+                                            grouped.named_steps.ridge.coef_).max())
+    return timings
+
+def bench_imputers(scales={'county': 3100, 'tract': 20000, 'precinct': 60000},
+                   n_features=100, max_knn_rows=20000, seed=0):
+    """ Time, memory and coefficient drift of each imputer backend in the ridge Pipeline
+
+        Drift is the largest coefficient difference from the KNNImputer fit at
+        the same scale, and is missing where KNNImputer is skipped because the
+        scale is above max_knn_rows.
+
+    Returns:
+        pandas.DataFrame with columns scale, rows, method, seconds, peak_mb, coef_drift
+    """
+    from sklearn.linear_model import RidgeCV
+    from sklearn.pipeline import Pipeline
+    alphas = (10**np.linspace(5, 3, 100)).tolist()
+    timings = []
+    for scale, n_rows in scales.items():
+        rng = np.random.default_rng(seed)
+        X = make_county_features(n_rows, n_features, seed=seed).to_numpy()
+        y = np.nan_to_num(X) @ rng.normal(0, 0.001, n_features) + rng.normal(0, 0.1, n_rows)
+        knn_coef = None
+        for method in impute.imputer_methods:
+            if method == 'knn' and n_rows > max_knn_rows:
+                continue
+            pipe = Pipeline([('imputer', impute.get_imputer(method)), ('ridge', RidgeCV(alphas))])
+            tracemalloc.start()
+            start = time.perf_counter()
+            pipe.fit(X, y)
+            seconds = time.perf_counter() - start
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+            coef = pipe.named_steps.ridge.coef_
+            if method == 'knn':
+                knn_coef = coef
+            drift = np.abs(coef - knn_coef).max() if knn_coef is not None else None
+            timings.append([scale, n_rows, method, seconds, peak_mb, drift])
+    return pd.DataFrame(timings, columns=['scale', 'rows', 'method', 'seconds', 'peak_mb', 'coef_drift'])
+
+def bench_ridge_path(n_counties=3100, n_features=600, n_alphas=100, seed=0):
+    """ RidgeCV against ridge_path on one imputed design matrix, and re-scoring
+        ridge_path on a ten times denser alpha grid from the same decomposition
+    """
+    from sklearn.linear_model import RidgeCV
+    rng = np.random.default_rng(seed)
+    X = impute.get_imputer('mean').fit_transform(make_county_features(n_counties, n_features, seed=seed))
+    y = X @ rng.normal(0, 0.001, n_features) + rng.normal(0, 0.1, n_counties)
+    alphas = (10**np.linspace(5, 3, n_alphas)).tolist()
+
+    start = time.perf_counter()
+    ridge_cv = RidgeCV(alphas).fit(X, y)
+    ridge_cv_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    path = ridge.ridge_path(alphas).fit(X, y)
+    path_seconds = time.perf_counter() - start
+    same_alpha = bool(ridge_cv.alpha_ == path.alpha_)
+    max_coef_diff = np.abs(ridge_cv.coef_ - path.coef_).max()
+
+    start = time.perf_counter()
+    path.set_alphas((10**np.linspace(5, 3, 10 * n_alphas)).tolist())
+    dense_seconds = time.perf_counter() - start
+    return {'ridge_cv_seconds': ridge_cv_seconds, 'path_seconds': path_seconds,
+            'dense_seconds': dense_seconds, 'same_alpha': same_alpha,
+            'max_coef_diff': max_coef_diff}
+
+def bench_bootstrap(workers=sorted({1, os.cpu_count()}), n_boot=40, n_counties=3100,
+                    n_features=200, imputer='mean', seed=0):
+    """ Seconds of ridge.bootstrap_ridge_path for each worker count
+
+    Returns:
+        dict of workers to seconds
+    """
+    rng = np.random.default_rng(seed)
+    X = make_county_features(n_counties, n_features, seed=seed)
+    y = np.nan_to_num(X.to_numpy()) @ rng.normal(0, 0.001, n_features) + rng.normal(0, 0.1, n_counties)
+    alphas = (10**np.linspace(5, 3, 100)).tolist()
+    seconds = {}
+    for n_workers in workers:
+        start = time.perf_counter()
+        ridge.bootstrap_ridge_path(X, y, alphas, n_boot=n_boot, imputer=imputer, workers=n_workers)
+        seconds[n_workers] = time.perf_counter() - start
+    return seconds
+
+def bench_split_models(n_counties=3100, n_features=300, n_targets=3, n_states=50,
+                       imputer='knn', workers=os.cpu_count(), seed=0):
+    """ One ridge.fit_subsets call against a separate imputer + RidgeCV fit per
+        target and subset, for a national model and one model per state
+    """
+    from sklearn.linear_model import RidgeCV
+    rng = np.random.default_rng(seed)
+    X = make_county_features(n_counties, n_features, seed=seed).reset_index(drop=True)
+    Y = pd.DataFrame(np.nan_to_num(X.to_numpy()) @ rng.normal(0, 0.001, (n_features, n_targets))
+                     + rng.normal(0, 0.1, (n_counties, n_targets)),
+                     columns=['target_' + str(t) for t in range(n_targets)])
+    alphas = (10**np.linspace(5, 3, 100)).tolist()
+    subsets = {'US': np.arange(n_counties)}
+    subsets.update(enumerate(np.array_split(rng.permutation(n_counties), n_states)))
+
+    start = time.perf_counter()
+    ridge.fit_subsets(X, Y, subsets, alphas, imputer=imputer, workers=workers)
+    batched_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for rows in subsets.values():
+        for target in Y.columns:
+            X_imputed = impute.get_imputer(imputer).fit_transform(X.iloc[rows])
+            RidgeCV(alphas).fit(X_imputed, Y[target].iloc[rows])
+    separate_seconds = time.perf_counter() - start
+    return {'models': len(subsets) * n_targets, 'batched_seconds': batched_seconds,
+            'separate_seconds': separate_seconds}
+
+#####################################################################################
+###############################     Startup Time     ################################
+#####################################################################################
+
+# entry point -> (argv, or None to import the module, seconds budget, modules it must not load)
+startup_budgets = {
+    'ddhq_scrape_county_returns.py --help': (['--help'], 1.0, ['sklearn', 'geopandas', 'sqlalchemy']),
+    'r_split_2020.py --help':               (['--help'], 1.0, ['sklearn', 'geopandas', 'sqlalchemy']),
+    'live_results.py --help':               (['--help'], 1.0, ['sklearn', 'geopandas', 'sqlalchemy']),
+    'import query_acs':                     (None, 1.0, ['sklearn', 'geopandas']),
+    'import nyt_precinct':                  (None, 1.0, ['sklearn', 'geopandas']),
+    'import query_tiger':                   (None, 1.5, ['sklearn'])}
+
+startup_script = """
+import json, runpy, sys, time
+start = time.perf_counter()
+name, argv = sys.argv[1], sys.argv[2:]
+if name.endswith('.py'):
+    sys.argv = [name] + argv
+    try:
+        runpy.run_path(name, run_name='__main__')
+    except SystemExit:
+        pass
+else:
+    __import__(name)
+sys.stderr.write(json.dumps({'seconds': time.perf_counter() - start,
+                             'modules': sorted(m for m in sys.modules if '.' not in m)}) + '\\n')
+"""
+
+def bench_startup(budgets=startup_budgets, repeat=3):
+    """ Cold start time of each entry point in a fresh interpreter, against its budget
+
+        Each entry point is run repeat times and the fastest run is kept, so
+        the time measures imports rather than a cold disk.
+
+    Returns:
+        pandas.DataFrame with columns entry, seconds, budget, heavy_modules, ok
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for entry, (argv, budget, forbidden) in budgets.items():
+        target = entry.split()[0] if argv is not None else entry.split()[1]
+        runs = []
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, '-c', startup_script, target] + (argv or []),
+                                  cwd=cwd, capture_output=True, text=True)
+            runs.append(json.loads(proc.stderr.strip().splitlines()[-1]))
+        best = min(runs, key=lambda run: run['seconds'])
+        heavy = [module for module in forbidden if module in best['modules']]
+        timings.append([entry, best['seconds'], budget, ','.join(heavy),
+                        best['seconds'] <= budget and not heavy])
+    return pd.DataFrame(timings, columns=['entry', 'seconds', 'budget', 'heavy_modules', 'ok'])
+
+
+#####################################################################################
+#############################     Benchmark Suite     ###############################
+#####################################################################################
+
+# results of run_suite, one json line per stage and version
+suite_results_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results.jsonl')
+
+def profile_stage(fn, *args, **kwargs):
+    """ Time fn, then call it again tracing its peak python memory
+
+        Tracing slows allocation heavy code several times over, so the timed
+        call runs untraced. fn should start cold on every call.
+
+    Returns:
+        tuple of (fn result, seconds, peak_mb)
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak_mb
+
+def get_version():
+    """ git describe of the working tree, or BENCH_VERSION if set or not a repo
+    """
+    if os.environ.get('BENCH_VERSION'):
+        return os.environ['BENCH_VERSION']
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run_suite(states=bench_states, n_races=4, n_cands=3, n_vars=150, tiger_states=10,
+              n_tracts=1000, imputer='knn'):
+    """ Time and memory-profile each pipeline stage against the stand-in server
+
+        DDHQ state payloads, ACS variables.json and profile responses, and TIGER
+        zips are generated up front and served locally, so nothing touches
+        embeds.ddhq.io, api.census.gov or census.gov. Every call of a network
+        stage gets empty cache directories, so it measures a cold run.
+
+    Stages:
+        ddhq_results_tbl  ddhq_scrape.set_ddhq_results_tbl for every state
+        r_pe_split        r_split_2020.get_r_pe_split on the parquet results
+        acs_pe            r_split_2020.get_acs_pe, metadata catalog included
+        tiger_shapes      query_tiger.get_tiger_shapes for tracts in tiger_states
+        imputer_ridge     imputer and ridge.ridge_path on the merged tables
+
+    Returns:
+        list of dict with keys stage, rows, seconds, peak_mb
+    """
+    groups = ['DP02', 'DP03', 'DP04', 'DP05']
+    state_json = {state: make_ddhq_state_json(state, len(get_county_names(state)) or 80,
+                                              n_races, n_cands, seed=i)['data']
+                  for i, state in enumerate(states)}
+    variables = make_acs_variables_json(groups, n_vars)
+    tiger_zips = {'tl_2020_{:02d}_tract.zip'.format(n): make_tiger_zip('{:02d}'.format(n), n_shapes=n_tracts)
+                  for n in range(1, tiger_states + 1)}
+    records = []
+
+    def record(stage, fn, *args):
+        result, seconds, peak_mb = profile_stage(fn, *args)
+        records.append({'stage': stage, 'rows': len(result), 'seconds': seconds, 'peak_mb': peak_mb})
+        return result
+
+    def set_results_tbls():
+        tbls = []
+        for state, races in state_json.items():
+            scrape = ddhq_scrape()
+            scrape.state_json = races
+            scrape.set_ddhq_results_tbl(state)
+            tbls.append(scrape.ddhq_results_tbl)
+        return pd.concat(tbls, axis=0, ignore_index=True)
+
+    results = record('ddhq_results_tbl', set_results_tbls)
+    results['datestamp'] = '20201103'
+
+    # ACS responses are sliced from one pre-generated table, so the server does
+    # little work inside the timed stage
+    acs_vars = ['GEO_ID'] + [var for var in variables['variables'] if var.endswith('PE')]
+    acs_rows = make_acs_response(acs_vars, fips=results['fips'].dropna().unique().tolist())
+    acs_table = pd.DataFrame(acs_rows[1:], columns=acs_rows[0])
+
+    def get_acs_response(params):
+        columns = params['get'].split(',') + ['state', 'county']
+        return [columns] + acs_table[columns].to_numpy().tolist()
+
+    acs_path = '/data/2019/acs/acs5/profile'
+    payloads = {acs_path + '/variables.json': variables, acs_path: get_acs_response,
+                '/TIGER2020/TRACT/': make_tiger_listing(tiger_zips)}
+    payloads.update({'/TIGER2020/TRACT/' + name: body for name, body in tiger_zips.items()})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results_file = os.path.join(tmp, 'results.parquet')
+        write_results(results, results_file)
+        r_pe_split = record('r_pe_split', r_split_2020.get_r_pe_split, results_file)
+
+        def get_acs_pe():
+            cache_path = tempfile.mkdtemp(dir=tmp)
+            http_cache.set_cache(http_cache.response_cache(path=os.path.join(cache_path, 'http')))
+            query_acs._catalogs[('2019', 'acs5', 'profile')] = query_acs.metadata_catalog(
+                '2019', 'acs5', 'profile', path=os.path.join(cache_path, 'acs'))
+            return r_split_2020.get_acs_pe(groups, None)
+
+        def get_tiger_shapes():
+            cache_path = tempfile.mkdtemp(dir=tmp)
+            http_cache.set_cache(http_cache.response_cache(path=os.path.join(cache_path, 'http')))
+            return query_tiger.get_tiger_shapes('TRACT', None, '2020', cache_path=cache_path)
+
+        acs_base_url, tiger_base_url = query_acs.acs_base_url, query_tiger.tiger_base_url
+        catalogs = dict(query_acs._catalogs)
+        with payload_server(payloads) as server:
+            query_acs.acs_base_url = server.url + '/data/'
+            query_tiger.tiger_base_url = server.url + '/'
+            try:
+                acs_pe = record('acs_pe', get_acs_pe)
+                record('tiger_shapes', get_tiger_shapes)
+            finally:
+                query_acs.acs_base_url, query_tiger.tiger_base_url = acs_base_url, tiger_base_url
+                query_acs._catalogs.clear()
+                query_acs._catalogs.update(catalogs)
+                http_cache.set_cache(None)
+
+    modeling_df = r_pe_split.merge(acs_pe)
+    X = modeling_df.drop(['fips', 'r_pe_split'], axis=1)
+    alphas = (10**np.linspace(5, 3, 100)).tolist()
+
+    def fit():
+        X_imputed = impute.get_imputer(imputer).fit_transform(X)
+        ridge.ridge_path(alphas).fit(X_imputed, modeling_df['r_pe_split'])
+        return X_imputed
+
+    record('imputer_ridge', fit)
+    return records
+
+def save_suite_results(records, file_name=suite_results_file, version=None):
+    """ Append run_suite records to file_name, one json line each, keyed by version
+    """
+    version = version or get_version()
+    timestamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(file_name, 'a') as f:
+        for rec in records:
+            f.write(json.dumps(dict(rec, version=version, timestamp=timestamp)) + '\n')
+
+def compare_suite_results(records, file_name=suite_results_file, version=None, tolerance=0.2,
+                          min_seconds=0.1):
+    """ Compare run_suite records with the latest stored run of another version
+
+    Args:
+        records   (list of dict) from run_suite
+        file_name (str) json lines written by save_suite_results
+        version   (str) version of records, default get_version()
+        tolerance (float) relative increase in seconds or peak_mb flagged as a regression
+        min_seconds (float) smaller slowdowns are timing noise, not regressions
+
+    Returns:
+        pandas.DataFrame with columns stage, seconds, peak_mb, base_version,
+        base_seconds, base_peak_mb, regression. Empty base columns if
+        nothing is stored for another version.
+    """
+    version = version or get_version()
+    current = pd.DataFrame(records).set_index('stage')[['seconds', 'peak_mb']]
+    base = pd.DataFrame(columns=['stage', 'version', 'seconds', 'peak_mb'])
+    if os.path.exists(file_name):
+        stored = pd.read_json(file_name, lines=True, dtype={'version': str})
+        stored = stored[stored['version'] != version]
+        if len(stored):
+            base = stored[stored['version'] == stored['version'].iloc[-1]]
+    base = base.drop_duplicates('stage', keep='last').set_index('stage')[['version', 'seconds', 'peak_mb']]
+    df = current.join(base.rename(columns={'version': 'base_version', 'seconds': 'base_seconds',
+                                           'peak_mb': 'base_peak_mb'}))
+    slower = ((df['seconds'] > df['base_seconds'] * (1 + tolerance)) &
+              (df['seconds'] - df['base_seconds'] > min_seconds))
+    df['regression'] = slower | (df['peak_mb'] > df['base_peak_mb'] * (1 + tolerance))
+    return df.reset_index()
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--counties', type=int, default=80)
+    arg_parser.add_argument('--races', type=int, default=4)
+    arg_parser.add_argument('--cands', type=int, default=3)
+    arg_parser.add_argument('--workers', type=int, default=8)
+    arg_parser.add_argument('--latency', type=float, default=0.2)
+    arg_parser.add_argument('--suite', action='store_true',
+                            help='profile each pipeline stage, store and compare the results')
+    arg_parser.add_argument('--results', default=suite_results_file,
+                            help='json lines file of stored suite results')
+    arg_parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='relative slowdown reported as a regression')
+    arg_parser.add_argument('--startup', action='store_true',
+                            help='check entry point start up times against their budgets')
+    args = arg_parser.parse_args()
+
+    if args.startup:
+        startup = bench_startup()
+        print(startup.to_string(index=False))
+        sys.exit(0 if startup['ok'].all() else 1)
+
+    if args.suite:
+        records = run_suite(n_races=args.races, n_cands=args.cands)
+        print(compare_suite_results(records, args.results, tolerance=args.tolerance).to_string(index=False))
+        save_suite_results(records, args.results)
+        return
+
+    parse = bench_ddhq_parse(n_counties=args.counties, n_races=args.races, n_cands=args.cands)
+    print('ddhq parse: {} states, {} vote rows, {:.3f}s'.format(
+        len(parse), parse.vote_rows.sum(), parse.seconds.sum()))
+
+    join = bench_ddhq_join()
+    print('ddhq join: {} result rows, {:.3f}s join, {:.3f}s sqldf'.format(
+        join.result_rows.sum(), join.join_seconds.sum(), join.sqldf_seconds.sum()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for ext in ['.json', '.parquet']:
+            votes = bench_party_votes(make_results_file(os.path.join(tmp, 'results' + ext)))
+            print('party votes {}: {} counties, {:.3f}s, {:.3f}s legacy, max diff {}'.format(
+                ext, votes['counties'], votes['seconds'], votes['legacy_seconds'],
+                votes['max_diff']))
+        compact = bench_compact_results(make_results_file(os.path.join(tmp, 'results.json')))
+        print('compact results: {} rows, {:.1f}MB frames, {:.1f}MB compact, {:.3f}s encode, {:.3f}s frame, {:.3f}s compact aggregate'.format(
+            compact['rows'], compact['frame_mb'], compact['compact_mb'], compact['encode_seconds'],
+            compact['frame_seconds'], compact['compact_seconds']))
+
+    live = bench_live_results()
+    print('live results: {} counties, {} changed, {:.3f}s first poll, {:.3f}s idle, {:.3f}s delta, {:.3f}s full refresh, max diff {}'.format(
+        live['counties'], live['changed_counties'], live['first_poll_seconds'],
+        live['idle_poll_seconds'], live['delta_poll_seconds'], live['full_seconds'],
+        live['max_diff']))
+
+    read = bench_precinct_read()
+    print('precinct read: {} precincts, {:.2f}s {:.0f}MB attributes, {:.2f}s geometry, {:.2f}s read_file, same rows {}'.format(
+        read['precincts'], read['attribute_seconds'], read['attribute_peak_mb'],
+        read['geometry_seconds'], read['read_file_seconds'], read['same_rows']))
+
+    fit = bench_grouped_fit()
+    print('precinct fit: merged {:.2f}s {:.0f}MB, grouped {:.2f}s {:.0f}MB, max coef diff {:.2g}'.format(
+        fit['merged_seconds'], fit['merged_peak_mb'], fit['grouped_seconds'],
+        fit['grouped_peak_mb'], fit['max_coef_diff']))
+
+    print(bench_imputers().to_string(index=False))
+
+    path = bench_ridge_path()
+    print('ridge path: RidgeCV {:.2f}s, ridge_path {:.2f}s, 10x alphas {:.2f}s, same alpha {}, max coef diff {:.2g}'.format(
+        path['ridge_cv_seconds'], path['path_seconds'], path['dense_seconds'],
+        path['same_alpha'], path['max_coef_diff']))
+
+    split = bench_split_models()
+    print('split models: {} models, {:.2f}s batched, {:.2f}s separate'.format(
+        split['models'], split['batched_seconds'], split['separate_seconds']))
+
+    for workers, seconds in bench_bootstrap().items():
+        print('bootstrap: {} workers, {:.2f}s'.format(workers, seconds))
+
+    for workers in sorted({1, args.workers}):
+        results, seconds = bench_ddhq_fetch(workers=workers, latency=args.latency,
+                                            n_counties=args.counties)
+        print('ddhq fetch: {} workers, {} result rows, {:.3f}s'.format(
+            workers, len(results), seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+
+# columns of the ddhq results table, see ddhq_scrape_county_returns.write_results
+results_columns = ['state_code', 'fips', 'county_name', 'party_name', 'first_name',
+                   'last_name', 'office', 'incumbent', 'votes']
+
+# columns that identify a candidate
+candidate_columns = ['state_code', 'office', 'party_name', 'first_name', 'last_name', 'incumbent']
+
+class compact_results:
+    """ Integer keyed election results for one or more cycles
+
+        Each vote row is an int32 fips, an int32 candidate code, an int32 place
+        code, an int8 cycle code and int32 votes. Candidates are a side table
+        with state, office and party stored as codes into the states, offices
+        and parties dictionaries, so names are held once per candidate rather
+        than once per county row. Places are the county or town names.
+
+        r_split_2020 vote functions accept a compact_results wherever they
+        accept a results file.
+
+        Example:
+            results = compact_results.from_file('election_results.parquet')
+            r_split_2020.get_party_votes_pe(results)
+    """
+    def __init__(self, fips, cand, place, cycle, votes, candidates, places, cycles,
+                 states, offices, parties):
+        self.fips = fips             # int32 county fips per row, -1 if unresolved
+        self.cand = cand             # int32 candidates row per row
+        self.place = place           # int32 places position per row
+        self.cycle = cycle           # int8 cycles position per row
+        self.votes = votes           # int32 votes per row
+        self.candidates = candidates # pandas.DataFrame with columns state, office, party codes,
+                                     # first_name, last_name, incumbent
+        self.places = places         # pandas.Index of county or town names
+        self.cycles = cycles         # pandas.Index of cycle labels, ex: datestamps
+        self.states = states         # pandas.Index of state codes
+        self.offices = offices       # pandas.Index of offices
+        self.parties = parties       # pandas.Index of party names
+
+    @classmethod
+    def from_frame(cls, df, cycle=None):
+        """ Encode a results table generated using ddhq_scrape_county_returns.py
+
+        Args:
+            df    (pandas.DataFrame) results with results_columns
+            cycle (str) cycle label, default the datestamp column or 'results'
+
+        Returns:
+            compact_results
+        """
+        df = df.reset_index(drop=True)
+        fips = pd.to_numeric(df['fips'], errors='coerce').fillna(-1).to_numpy(dtype=np.int32)
+        if cycle is None and 'datestamp' in df.columns:
+            cycle_codes, cycles = pd.factorize(df['datestamp'].astype(str))
+        else:
+            cycle_codes = np.zeros(len(df), dtype=np.int64)
+            cycles = pd.Index([cycle or 'results'])
+        place_codes, places = pd.factorize(df['county_name'])
+
+        # one candidate row per distinct candidate, in order of first appearance
+        cand_codes = df.groupby(candidate_columns, sort=False, dropna=False,
+                                observed=True).ngroup().to_numpy()
+        first_rows = pd.Series(np.arange(len(df))).groupby(cand_codes).first().to_numpy()
+        cand_df = df.iloc[first_rows]
+        state_codes, states = pd.factorize(cand_df['state_code'].astype(str))
+        office_codes, offices = pd.factorize(cand_df['office'].astype(str))
+        party_codes, parties = pd.factorize(cand_df['party_name'].astype(str))
+        candidates = pd.DataFrame({
+            'state':      state_codes.astype(np.int16),
+            'office':     office_codes.astype(np.int16),
+            'party':      party_codes.astype(np.int16),
+            'first_name': cand_df['first_name'].to_numpy(),
+            'last_name':  cand_df['last_name'].to_numpy(),
+            'incumbent':  cand_df['incumbent'].astype(bool).to_numpy()})
+        return cls(fips, cand_codes.astype(np.int32), place_codes.astype(np.int32),
+                   cycle_codes.astype(np.int8),
+                   pd.to_numeric(df['votes']).fillna(0).to_numpy(dtype=np.int32),
+                   candidates, pd.Index(places), pd.Index(cycles), pd.Index(states),
+                   pd.Index(offices), pd.Index(parties))
+
+    @classmethod
+    def from_file(cls, file_name, cycle=None):
+        """ Read and encode a json or parquet results file
+        """
+        if file_name.endswith('.parquet'):
+            df = pd.read_parquet(file_name)
+        else:
+            df = pd.read_json(file_name, dtype={'fips': 'object', 'datestamp': 'object'})
+        return cls.from_frame(df, cycle)
+
+    @classmethod
+    def concat(cls, results_list):
+        """ Combine results, ex: of several cycles, re-coding the dictionaries
+        """
+        def recode(indexes):
+            combined = pd.Index(pd.unique(np.concatenate([index.to_numpy() for index in indexes])))
+            return combined, [combined.get_indexer(index) for index in indexes]
+
+        places, place_maps = recode([r.places for r in results_list])
+        cycles, cycle_maps = recode([r.cycles for r in results_list])
+        states, state_maps = recode([r.states for r in results_list])
+        offices, office_maps = recode([r.offices for r in results_list])
+        parties, party_maps = recode([r.parties for r in results_list])
+        candidates, cand, offset = [], [], 0
+        for i, r in enumerate(results_list):
+            candidates.append(r.candidates.assign(
+                state=state_maps[i][r.candidates['state']].astype(np.int16),
+                office=office_maps[i][r.candidates['office']].astype(np.int16),
+                party=party_maps[i][r.candidates['party']].astype(np.int16)))
+            cand.append(r.cand + offset)
+            offset += len(r.candidates)
+        return cls(np.concatenate([r.fips for r in results_list]),
+                   np.concatenate(cand).astype(np.int32),
+                   np.concatenate([place_maps[i][r.place] for i, r in enumerate(results_list)]).astype(np.int32),
+                   np.concatenate([cycle_maps[i][r.cycle] for i, r in enumerate(results_list)]).astype(np.int8),
+                   np.concatenate([r.votes for r in results_list]),
+                   pd.concat(candidates, ignore_index=True), places, cycles, states, offices, parties)
+
+    def get_cycle(self, cycle):
+        """ Results of one cycle, sharing the side tables
+        """
+        keep = self.cycle == self.cycles.get_loc(cycle)
+        return compact_results(self.fips[keep], self.cand[keep], self.place[keep],
+                               np.zeros(keep.sum(), dtype=np.int8), self.votes[keep],
+                               self.candidates, self.places, pd.Index([cycle]),
+                               self.states, self.offices, self.parties)
+
+    def get_codes(self, parties, offices):
+        """ Integer codes of each vote row for aggregate_party_votes in r_split_2020
+
+            Rows in other offices or with unresolved fips are dropped. Results
+            must hold a single cycle, see get_cycle.
+
+        Args:
+            parties (list of str) parties to code, others get -1
+            offices (list of str) offices to keep
+
+        Returns:
+            tuple of (fips str array, fips codes, office codes, party codes, votes)
+        """
+        if len(self.cycles) > 1:
+            raise Exception('results hold several cycles, select one with get_cycle')
+        # positions in the requested lists for each dictionary entry, then each candidate
+        office_pos = pd.Index(offices).get_indexer(self.offices)
+        party_pos = pd.Index(parties).get_indexer(self.parties)
+        cand_office = office_pos[self.candidates['office'].to_numpy()]
+        cand_party = party_pos[self.candidates['party'].to_numpy()]
+        office_codes = cand_office[self.cand]
+        keep = (office_codes >= 0) & (self.fips >= 0)
+        fips_uq, fips_codes = np.unique(self.fips[keep], return_inverse=True)
+        return (pd.Index(fips_uq).astype(str).str.zfill(5).to_numpy(), fips_codes,
+                office_codes[keep], cand_party[self.cand[keep]], self.votes[keep])
+
+    def to_frame(self, columns=results_columns, offices=None, parties=None):
+        """ Expand back to a results table, optionally for some offices and parties
+
+        Returns:
+            pandas.DataFrame with columns, plus datestamp if asked for
+        """
+        cand = self.candidates
+        keep = np.ones(len(self.votes), dtype=bool)
+        if offices:
+            keep &= pd.Index(offices).get_indexer(self.offices)[cand['office'].to_numpy()][self.cand] >= 0
+        if parties:
+            keep &= pd.Index(parties).get_indexer(self.parties)[cand['party'].to_numpy()][self.cand] >= 0
+        rows = self.cand[keep]
+        fips = pd.Series(self.fips[keep]).astype(str).str.zfill(5)
+        values = {
+            'state_code':  lambda: self.states[cand['state'].to_numpy()[rows]],
+            'fips':        lambda: fips.where(self.fips[keep] >= 0, None).to_numpy(),
+            'county_name': lambda: self.places[self.place[keep]],
+            'party_name':  lambda: self.parties[cand['party'].to_numpy()[rows]],
+            'first_name':  lambda: cand['first_name'].to_numpy()[rows],
+            'last_name':   lambda: cand['last_name'].to_numpy()[rows],
+            'office':      lambda: self.offices[cand['office'].to_numpy()[rows]],
+            'incumbent':   lambda: cand['incumbent'].to_numpy()[rows],
+            'votes':       lambda: self.votes[keep].astype(np.int64),
+            'datestamp':   lambda: self.cycles[self.cycle[keep]]}
+        return pd.DataFrame({col: np.asarray(values[col]()) for col in columns})
+
+    @property
+    def nbytes(self):
+        """ Bytes held by the arrays and side tables
+        """
+        arrays = sum(a.nbytes for a in [self.fips, self.cand, self.place, self.cycle, self.votes])
+        tables = int(self.candidates.memory_usage(deep=True).sum())
+        indexes = sum(index.memory_usage(deep=True) for index in
+                      [self.places, self.cycles, self.states, self.offices, self.parties])
+        return arrays + tables + indexes
+
+    def __len__(self):
+        return len(self.votes)
@@ -0,0 +1,122 @@
+import os
+import pickle
+import threading
+import addfips
+
+# one index per process, built on first use
+_index = None
+_index_lock = threading.Lock()
+
+class county_fips_index:
+    """ County FIPS lookup built once and shared between scrapes
+
+        Wraps addfips.AddFIPS so its lookup tables are loaded a single time, and
+        remembers every (state, county name) and DDHQ county id it has resolved.
+        Names that cannot be resolved are collected in unresolved. A saved index
+        only loads addfips when it meets a county it has not seen.
+
+        Example:
+            index = get_county_fips_index()
+            index.resolve(['WI', 'WI'], ['Dane', 'Milwaukee'])
+    """
+    def __init__(self, vintage=None):
+        self.vintage = vintage  # addfips county file vintage, default latest
+        self.addf = None        # addfips.AddFIPS, loaded on first lookup
+        self.names = {}         # (state, county name) -> fips or None
+        self.ddhq_ids = {}      # (state, ddhq county id) -> fips
+        self.unresolved = set() # (state, county name) pairs with no fips
+        self.lock = threading.Lock()
+
+    def resolve(self, states, counties, ddhq_ids=None):
+        """ Get FIPS codes for a batch of counties
+
+            Each distinct county is looked up once; repeats and previously seen
+            DDHQ county ids are answered from memory.
+
+        Args:
+            states   (list of str) state name, abbreviation or fips for each county
+            counties (list of str) county names
+            ddhq_ids (list)        DDHQ county ids, optional
+
+        Returns:
+            list of str fips codes, None where the county could not be resolved
+        """
+        if ddhq_ids is None:
+            ddhq_ids = [None] * len(counties)
+        fips_list = []
+        with self.lock:
+            for state, county, ddhq_id in zip(states, counties, ddhq_ids):
+                fips = self.ddhq_ids.get((state, ddhq_id))
+                if fips is None:
+                    key = (state, county)
+                    if key in self.names:
+                        fips = self.names[key]
+                    else:
+                        if self.addf is None:
+                            self.addf = addfips.AddFIPS(self.vintage)
+                        fips = self.addf.get_county_fips(county=county, state=state)
+                        self.names[key] = fips
+                        if fips is None:
+                            self.unresolved.add(key)
+                    if fips is not None and ddhq_id is not None:
+                        self.ddhq_ids[(state, ddhq_id)] = fips
+                fips_list.append(fips)
+        return fips_list
+
+    def get_unresolved(self, state=None):
+        """ County names that could not be resolved, optionally for one state
+        """
+        return sorted(name for st, name in self.unresolved if state is None or st == state)
+
+    def save(self, path):
+        """ Pickle everything the index has resolved to path
+        """
+        with self.lock:
+            state = {'vintage': self.vintage, 'names': self.names,
+                     'ddhq_ids': self.ddhq_ids, 'unresolved': self.unresolved}
+            with open(path, 'wb') as f:
+                pickle.dump(state, f)
+
+    @classmethod
+    def load(cls, path):
+        """ Load an index saved with save()
+        """
+        index = cls.__new__(cls)
+        with open(path, 'rb') as f:
+            index.__dict__.update(pickle.load(f))
+        index.addf = None
+        index.lock = threading.Lock()
+        return index
+
+def get_county_fips_index(path=None):
+    """ Get the process wide county FIPS index
+
+    Args:
+        path (str) pickle to load the index from if it exists.
+            Default COUNTY_FIPS_INDEX environment variable.
+
+    Returns:
+        county_fips_index
+    """
+    global _index
+    if path is None:
+        path = os.environ.get('COUNTY_FIPS_INDEX')
+    with _index_lock:
+        if _index is None:
+            if path and os.path.exists(path):
+                _index = county_fips_index.load(path)
+            else:
+                _index = county_fips_index()
+    return _index
+
+def save_county_fips_index(path=None):
+    """ Save the process wide county FIPS index to path, if path is set
+
+    Args:
+        path (str) pickle to save the index to.
+            Default COUNTY_FIPS_INDEX environment variable.
+    """
+    if path is None:
+        path = os.environ.get('COUNTY_FIPS_INDEX')
+    if path and _index is not None:
+        _index.save(path)
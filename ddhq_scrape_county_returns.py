@@ -1,37 +1,184 @@
 # libraries
 import sys
+import os
 import argparse
 import json
+import hashlib
 import requests
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import pandasql as ps
-import addfips
+import http_cache
+import instrument
+from http_cache import get_session
+from county_fips import get_county_fips_index, save_county_fips_index
 
-def main():
+ddhq_url = 'https://embeds.ddhq.io/api/v2/2020general_results/2020general_'
 
-    ddhq_results = pd.DataFrame(columns=['state_code', 'fips', 'county_name', 'party_name',
-                                         'first_name', 'last_name', 'office',
-                                         'incumbent', 'votes'])
+def main():
 
     arg_parser = argparse.ArgumentParser()
-    arg_parser.add_argument('--dest', type=str)
+    arg_parser.add_argument('--dest', type=str,
+                            help='file to save results. .parquet writes a typed columnar file, '
+                                 'anything else json')
     arg_parser.add_argument('--states', nargs='*', type=str)
+    arg_parser.add_argument('--workers', type=int, default=1,
+                            help='states to fetch and parse in parallel')
+    arg_parser.add_argument('--timeout', type=float, default=30,
+                            help='seconds to wait on each state request')
+    arg_parser.add_argument('--retries', type=int, default=3,
+                            help='retries for failed state requests')
+    arg_parser.add_argument('--store', type=str,
+                            help='directory of an incremental results store. only states '
+                                 'whose payload changed since the last run are parsed')
+    arg_parser.add_argument('--trace', type=str,
+                            help='append a json lines trace of stage timings and http calls. '
+                                 'same as setting PIPELINE_TRACE')
     args = arg_parser.parse_args()
+    if args.trace:
+        instrument.enable(args.trace)
 
     # destination to save scrape result
     states = args.states
-    
-    for state in states:
-        ddhq_state_scrape = ddhq_scrape()
-        ddhq_state_scrape.set_ddhq_results_tbl(state)
-        ddhq_results = pd.concat([ddhq_results, ddhq_state_scrape.ddhq_results_tbl], 
-                                 axis=0, ignore_index=True)
+
+    if args.store:
+        changed = scrape_states_incremental(states, args.store, workers=args.workers,
+                                            timeout=args.timeout, retries=args.retries)
+        save_county_fips_index()
+        print('changed states: ' + ' '.join(changed))
+        if args.dest:
+            write_results(read_store(args.store, states), args.dest)
+        return
+
+    ddhq_results = scrape_states(states, workers=args.workers,
+                                 timeout=args.timeout, retries=args.retries)
+    save_county_fips_index()
 
     dstamp = datetime.today().strftime("%Y%m%d")
     ddhq_results['datestamp'] = dstamp
 
-    ddhq_results.to_json(args.dest)
+    write_results(ddhq_results, args.dest)
+
+@instrument.traced('ddhq.write_results')
+def write_results(ddhq_results, dest):
+    """
+    save results table to dest as json, or as typed parquet if dest ends with .parquet
+
+    in parquet files state_code, party_name, office and datestamp are categoricals,
+    fips is a 5 character key and votes an integer. rows are sorted by office and
+    party so readers can skip row groups when filtering on them.
+    """
+    if not dest.endswith('.parquet'):
+        ddhq_results.to_json(dest)
+        return
+    ddhq_results = ddhq_results.assign(
+        fips=ddhq_results['fips'].astype('string').str.zfill(5),
+        votes=ddhq_results['votes'].astype('int64'),
+        incumbent=ddhq_results['incumbent'].astype('bool'))
+    for col in ['state_code', 'party_name', 'office', 'datestamp']:
+        ddhq_results[col] = ddhq_results[col].astype('category')
+    ddhq_results = ddhq_results.sort_values(['office', 'party_name', 'state_code', 'fips'])
+    ddhq_results.to_parquet(dest, index=False, row_group_size=64 * 1024)
+
+def scrape_state(state, session=None, timeout=None, base_url=ddhq_url):
+    """
+    returns ddhq results table for one state
+    """
+    ddhq_state_scrape = ddhq_scrape(session=session, timeout=timeout, base_url=base_url)
+    ddhq_state_scrape.set_ddhq_results_tbl(state)
+    return ddhq_state_scrape.ddhq_results_tbl
+
+@instrument.traced('ddhq.scrape_states', rows=len)
+def scrape_states(states, workers=1, timeout=30, retries=3, base_url=ddhq_url, session=None):
+    """
+    returns ddhq results table for all states
+
+    states are fetched and parsed by a pool of workers sharing one session, and
+    concatenated once at the end.
+    """
+    if session is None:
+        session = get_session(workers, retries)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        state_results = list(executor.map(
+            lambda state: scrape_state(state, session, timeout, base_url), states))
+    ddhq_results = pd.DataFrame(columns=['state_code', 'fips', 'county_name', 'party_name',
+                                         'first_name', 'last_name', 'office',
+                                         'incumbent', 'votes'])
+    state_results = [df for df in state_results if not df.empty]
+    if state_results:
+        ddhq_results = pd.concat(state_results, axis=0, ignore_index=True)
+    return ddhq_results
+
+def read_manifest(store):
+    """
+    returns dict of state -> hash, etag, datestamp and file of its latest part in store
+    """
+    try:
+        with open(os.path.join(store, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def write_manifest(store, manifest):
+    tmp = os.path.join(store, 'manifest.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(store, 'manifest.json'))
+
+@instrument.traced('ddhq.scrape_states_incremental', rows=len)
+def scrape_states_incremental(states, store, workers=1, timeout=30, retries=3,
+                              base_url=ddhq_url, session=None):
+    """
+    scrape states into an append-only results store, parsing only changed payloads
+
+    each state payload is hashed and compared with the hash recorded by the last
+    run. results for changed states are written to <store>/<state>_<datestamp>.json;
+    a state scraped again on the same day replaces that day's part. the manifest
+    records the latest part of each state.
+
+    returns list of states whose results changed
+    """
+    os.makedirs(store, exist_ok=True)
+    if session is None:
+        session = get_session(workers, retries)
+    manifest = read_manifest(store)
+    dstamp = datetime.today().strftime("%Y%m%d")
+
+    def scrape_changed(state):
+        ddhq_state_scrape = ddhq_scrape(session=session, timeout=timeout, base_url=base_url)
+        # unchanged payloads are not parsed and leave state_json None
+        ddhq_state_scrape.set_state_json(state, known_hash=manifest.get(state, {}).get('hash'))
+        if ddhq_state_scrape.state_json == None:
+            return None
+        ddhq_state_scrape.set_ddhq_results_tbl(state)
+        file_name = state + '_' + dstamp + '.json'
+        state_results = ddhq_state_scrape.ddhq_results_tbl.assign(datestamp=dstamp)
+        state_results.to_json(os.path.join(store, file_name))
+        return state, {'hash': ddhq_state_scrape.state_hash, 'etag': ddhq_state_scrape.etag,
+                       'datestamp': dstamp, 'file': file_name}
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        changed = [c for c in executor.map(scrape_changed, states) if c is not None]
+    for state, entry in changed:
+        manifest[state] = entry
+    write_manifest(store, manifest)
+    return [state for state, _ in changed]
+
+def read_store(store, states=None):
+    """
+    returns latest results for states (default all) in an incremental results store
+    """
+    manifest = read_manifest(store)
+    if states is None:
+        states = sorted(manifest)
+    state_results = [pd.read_json(os.path.join(store, manifest[state]['file']),
+                                  dtype={'fips': 'object', 'datestamp': 'object'})
+                     for state in states if state in manifest]
+    if not state_results:
+        return pd.DataFrame(columns=['state_code', 'fips', 'county_name', 'party_name',
+                                     'first_name', 'last_name', 'office',
+                                     'incumbent', 'votes', 'datestamp'])
+    return pd.concat(state_results, axis=0, ignore_index=True)
 
 def get_state_abbr():
     """
@@ -47,126 +194,148 @@ def get_state_abbr():
     return(states)
 
 class ddhq_scrape:
-    def __init__(self):
+    def __init__(self, session=None, timeout=None, base_url=ddhq_url, fips_index=None):
+        self.session = session   # requests.Session shared between scrapes, optional
+        self.timeout = timeout   # seconds to wait on the state request
+        self.base_url = base_url # state abbreviation is appended to this url
+        # county_fips.county_fips_index, default shared process wide index
+        self.fips_index = fips_index if fips_index is not None else get_county_fips_index()
         self.state_json = None
+        self.state_hash = None   # sha256 of the state payload
+        self.etag = None         # ETag of the state payload, if the api sent one
         self.counties_tbl = pd.DataFrame(columns=['fips', 'ddhq_county_id', 'county_name'])
         self.candidates_tbl = pd.DataFrame(columns=['race_id', 'office', 'state_code', 'cand_id', 
                                                     'party_name', 'first_name', 'last_name', 'incumbent'])
         self.votes_tbl = pd.DataFrame(columns=['race_id', 'cand_id', 'ddhq_county_id', 'votes'])
-        self.ddhq_results_tbl = pd.DataFrame(columns=['state_code', 'county_name', 'party_name',
+        self.ddhq_results_tbl = pd.DataFrame(columns=['state_code', 'fips', 'county_name', 'party_name',
                                                       'first_name', 'last_name', 'office',
                                                       'incumbent', 'votes'])
 
-    def set_state_json(self, state):
+    def set_state_json(self, state, known_hash=None):
+        """
+        fetch the state payload into state_json
+
+        if the payload hash equals known_hash the payload is not parsed, only
+        state_hash and etag are set and state_json stays None.
+        """
         # build url for api query
         state_lower = state.lower()
-        state_res_url = 'https://embeds.ddhq.io/api/v2/2020general_results/2020general_'+state_lower
+        state_res_url = self.base_url + state_lower
         # attempt to query the api and return json
+        # results change during the count, so always revalidate cached payloads
         try:
-            r = requests.get(state_res_url)
-        except ValueError:
+            with instrument.get_span('ddhq.fetch', state=state):
+                r = http_cache.get(state_res_url, session=self.session, timeout=self.timeout, ttl=0)
+                instrument.count('ddhq.fetches')
+                state_hash = hashlib.sha256(r.content).hexdigest()
+                if r.status_code == 200 and state_hash == known_hash:
+                    instrument.count('ddhq.unchanged_payloads')
+                    self.state_hash = state_hash
+                    self.etag = r.headers.get('ETag')
+                    return
+                state_json = r.json()
+        except (requests.RequestException, ValueError, LookupError):
             print('json not found for: ' + state)
+            return
         # if the api query seems successful, return the election results stored under data
-        if r.status_code == 200 and isinstance(r.json(), dict):
-            self.state_json=r.json()['data']
+        if r.status_code == 200 and isinstance(state_json, dict):
+            self.state_json = state_json['data']
+            self.state_hash = state_hash
+            self.etag = r.headers.get('ETag')
     
-    def set_counties_tbl(self, state):
+    def set_tbls(self, state):
+        """
+        walk the race json once and build the counties, candidates and votes tables
+
+        rows are collected in column buffers and each table is built in a single step.
+        """
         if self.state_json == None:
             self.set_state_json(state)
+        with instrument.get_span('ddhq.parse', state=state) as span:
+            self.build_tbls(state)
+            span.set(rows=len(self.votes_tbl))
+        instrument.count('ddhq.parsed_rows', len(self.votes_tbl))
+
+    def build_tbls(self, state):
+        """
+        build the tables from state_json, see set_tbls
+        """
+        counties = {col: [] for col in self.counties_tbl.columns}
+        candidates = {col: [] for col in self.candidates_tbl.columns}
+        votes = {col: [] for col in self.votes_tbl.columns}
         for race in self.state_json:
-            try: 
+            for candidate in race['candidates']:
+                candidates['race_id'].append(race['race_id'])
+                candidates['office'].append(race['office'])
+                candidates['state_code'].append(race['abb'])
+                candidates['cand_id'].append(candidate['cand_id'])
+                candidates['party_name'].append(candidate['party_name'])
+                candidates['first_name'].append(candidate['first_name'])
+                candidates['last_name'].append(candidate['last_name'])
+                candidates['incumbent'].append(candidate['incumbent'])
+            try:
                 county_results = race['countyResults']
                 # some state election results are not strictly organized by county.
             except KeyError:
                 county_results = race['vcuResults']
             for county in county_results['counties']:
-                # use addfips api to generate fips codes
-                addf = addfips.AddFIPS()
-                fips = addf.get_county_fips(county = county['county'], state = state)
-                new_row = [[
-                    fips,
-                    county['id'],
-                    county['county']
-                ]]
-                self.counties_tbl = self.counties_tbl.append(
-                    pd.DataFrame(new_row, columns=self.counties_tbl.columns),
-                    ignore_index=True)
-                self.counties_tbl = self.counties_tbl.drop_duplicates().reset_index(drop=True)
+                counties['ddhq_county_id'].append(county['id'])
+                counties['county_name'].append(county['county'])
+                for cand_id in county['votes']:
+                    votes['race_id'].append(race['race_id'])
+                    votes['cand_id'].append(cand_id)
+                    votes['ddhq_county_id'].append(county['id'])
+                    votes['votes'].append(county['votes'][cand_id])
+        # resolve fips codes for all counties in one batch
+        counties['fips'] = self.fips_index.resolve(
+            [state] * len(counties['county_name']), counties['county_name'],
+            counties['ddhq_county_id'])
+        unresolved = self.fips_index.get_unresolved(state)
+        if unresolved:
+            print('fips not found for: ' + state + ' ' + ', '.join(unresolved))
+        self.counties_tbl = pd.DataFrame(counties, columns=self.counties_tbl.columns)
+        self.counties_tbl = self.counties_tbl.drop_duplicates().reset_index(drop=True)
+        self.candidates_tbl = pd.DataFrame(candidates, columns=self.candidates_tbl.columns)
+        self.votes_tbl = pd.DataFrame(votes, columns=self.votes_tbl.columns)
+
+    def set_counties_tbl(self, state):
+        self.set_tbls(state)
 
     def set_candidates_tbl(self, state):
         """
         create table of candidates with candidate and race id, office, state, party, incumbent status
         """
-        if self.state_json == None:
-            self.set_state_json(state)
-        for race in self.state_json:
-            candidates = race['candidates']
-            for candidate in candidates:
-                new_row = [[
-                    race['race_id'], 
-                    race['office'], 
-                    race['abb'],
-                    candidate['cand_id'],
-                    candidate['party_name'],
-                    candidate['first_name'],
-                    candidate['last_name'],
-                    candidate['incumbent']
-                ]]
-                self.candidates_tbl = self.candidates_tbl.append(
-                    pd.DataFrame(new_row, columns=self.candidates_tbl.columns), 
-                    ignore_index=True)
+        self.set_tbls(state)
 
     def set_votes_tbl(self, state):
-        if self.state_json == None:
-            self.set_state_json(state)
-        for race in self.state_json:
-            try: 
-                counties = race['countyResults']['counties']
-            except KeyError:
-                counties = race['vcuResults']['counties']
-            for county in counties:
-                for cand_id in county['votes']:
-                    new_row = [[
-                        race['race_id'],
-                        cand_id,
-                        county['id'],
-                        county['votes'][cand_id]
-                    ]]
-                    self.votes_tbl = self.votes_tbl.append(
-                        pd.DataFrame(new_row, columns=self.votes_tbl.columns), 
-                        ignore_index=True)
+        self.set_tbls(state)
 
     def set_ddhq_results_tbl(self, state):
         if self.state_json == None:
             self.set_state_json(state)
-        if self.counties_tbl.empty:
-            self.set_counties_tbl(state)
-        if self.candidates_tbl.empty:
-            self.set_candidates_tbl(state)
+        if self.state_json == None:
+            return
+        if self.votes_tbl.empty:
+            self.set_tbls(state)
         if self.votes_tbl.empty:
-            self.set_votes_tbl(state)
-
-        # sqldf seems to have trouble accessing tables stored as attributes 
-        votes_tbl = self.votes_tbl
-        counties_tbl = self.counties_tbl
-        candidates_tbl = self.candidates_tbl
-
-        self.ddhq_results_tbl = ps.sqldf("""
-            SELECT
-              cand.state_code
-            , county.fips
-            , county.county_name
-            , cand.party_name
-            , cand.first_name
-            , cand.last_name
-            , cand.office
-            , cand.incumbent
-            , vote.votes
-            FROM votes_tbl vote
-            INNER JOIN counties_tbl county ON vote.ddhq_county_id = county.ddhq_county_id
-            INNER JOIN candidates_tbl cand ON vote.race_id = cand.race_id AND vote.cand_id = cand.cand_id
-            """,
-            locals())
+            return
+
+        # indexed inner joins of votes to candidates on (race_id, cand_id) and to
+        # counties on ddhq_county_id. vote cand_ids are json keys, so compare as str.
+        candidates_tbl = self.candidates_tbl.assign(
+            cand_id=self.candidates_tbl['cand_id'].astype(str)).set_index(['race_id', 'cand_id'])
+        counties_tbl = self.counties_tbl.set_index('ddhq_county_id')
+        votes_tbl = self.votes_tbl.assign(cand_id=self.votes_tbl['cand_id'].astype(str))
+
+        with instrument.get_span('ddhq.join', state=state) as span:
+            ddhq_results_tbl = (votes_tbl
+                .join(candidates_tbl, on=['race_id', 'cand_id'], how='inner')
+                .join(counties_tbl, on='ddhq_county_id', how='inner'))
+            self.ddhq_results_tbl = ddhq_results_tbl[[
+                'state_code', 'fips', 'county_name', 'party_name', 'first_name',
+                'last_name', 'office', 'incumbent', 'votes']].reset_index(drop=True)
+            span.set(rows=len(self.ddhq_results_tbl))
+        instrument.count('ddhq.joined_rows', len(self.ddhq_results_tbl))
 
 if __name__ == '__main__':
   main()
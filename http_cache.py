@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+import instrument
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# cache settings, overridden with environment variables
+cache_dir = os.environ.get('HTTP_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'election_analysis', 'http'))
+cache_ttl = float(os.environ.get('HTTP_CACHE_TTL', 7 * 24 * 60 * 60))    # seconds
+cache_max_bytes = int(os.environ.get('HTTP_CACHE_MAX_BYTES', 2 * 1024**3))
+cache_offline = os.environ.get('HTTP_CACHE_OFFLINE', '0') not in ('', '0', 'false')
+
+# query parameters left out of cache keys
+private_params = ['key']
+
+# one cache per process, built on first use
+_cache = None
+_cache_lock = threading.Lock()
+
+class cached_response:
+    """ Minimal stand-in for requests.Response returned by response_cache.get
+    """
+    def __init__(self, url, status_code, content, headers, from_cache):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.from_cache = from_cache # True if the body was not downloaded
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+class response_cache:
+    """ On-disk cache of HTTP GET responses
+
+        Responses are stored under the sha256 of the url and query parameters,
+        leaving out the Census API key. Entries younger than ttl are returned
+        without a request. Older entries are revalidated with If-None-Match /
+        If-Modified-Since, so an unchanged resource costs a 304 instead of a
+        download. The least recently used entries are evicted once the cache
+        holds more than max_bytes. In offline mode cached entries are always
+        returned and uncached urls raise LookupError.
+
+        Example:
+            cache = response_cache()
+            r = cache.get('https://api.census.gov/data/2019/acs/acs5/profile/variables.json')
+            r.json()
+    """
+    def __init__(self, path=cache_dir, ttl=cache_ttl, max_bytes=cache_max_bytes,
+                 offline=cache_offline):
+        self.path = path           # directory holding cached responses
+        self.ttl = ttl             # seconds before an entry is revalidated
+        self.max_bytes = max_bytes # size bound for cached bodies
+        self.offline = offline     # never touch the network
+        self.total_bytes = None    # running size of cached bodies, None until the first scan
+        self.lock = threading.Lock()
+
+    def get_key(self, url, params=None):
+        """ sha256 of url and params with private params removed
+        """
+        scheme, netloc, path, query, _ = urlsplit(url)
+        items = parse_qsl(query, keep_blank_values=True)
+        if params:
+            items += [(k, v) for k, v in params.items() if v is not None]
+        items = sorted((k, str(v)) for k, v in items if k not in private_params)
+        key_url = urlunsplit((scheme, netloc, path, urlencode(items), ''))
+        return hashlib.sha256(key_url.encode('utf-8')).hexdigest()
+
+    def get_entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def read_entry(self, key):
+        entry_path = self.get_entry_path(key)
+        try:
+            with open(entry_path + '.json', 'r') as f:
+                meta = json.load(f)
+            with open(entry_path + '.body', 'rb') as f:
+                content = f.read()
+            # last access time orders lru eviction
+            os.utime(entry_path + '.body')
+        except (OSError, ValueError):
+            return None, None
+        return meta, content
+
+    def write_entry(self, key, meta, content=None):
+        entry_path = self.get_entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # unique per process and thread, as several processes may share the cache
+        tmp = entry_path + '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+        if content is not None:
+            with open(tmp + '.body', 'wb') as f:
+                f.write(content)
+            os.replace(tmp + '.body', entry_path + '.body')
+        with open(tmp + '.json', 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp + '.json', entry_path + '.json')
+
+    def add_bytes(self, n_bytes):
+        """ Add n_bytes to the running size and evict once it is over max_bytes
+
+            The cache directory is only scanned on first use and when evicting,
+            which also corrects the total for entries written by other processes.
+        """
+        with self.lock:
+            if self.total_bytes is None or self.total_bytes + n_bytes > self.max_bytes:
+                self.evict()
+            else:
+                self.total_bytes += n_bytes
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits max_bytes
+        """
+        entries = []
+        total = 0
+        for root, _, file_names in os.walk(self.path):
+            for file_name in file_names:
+                if file_name.endswith('.body'):
+                    body = os.path.join(root, file_name)
+                    try:
+                        st = os.stat(body)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, body))
+                    total += st.st_size
+        for _, size, body in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for suffix in ('.body', '.json'):
+                try:
+                    os.remove(body[:-5] + suffix)
+                except OSError:
+                    pass
+            total -= size
+        self.total_bytes = total
+
+    def get(self, url, params=None, session=None, timeout=None, ttl=None):
+        """ GET url through the cache
+
+        Args:
+            url     (str)  request url
+            params  (dict) query parameters, None values are dropped
+            session (requests.Session) session to send requests with, optional
+            timeout (float) seconds to wait on the request
+            ttl     (float) seconds an entry is fresh, default self.ttl
+
+        Returns:
+            cached_response
+        """
+        ttl = self.ttl if ttl is None else ttl
+        key = self.get_key(url, params)
+        meta, content = self.read_entry(key)
+        if meta is not None and (self.offline or time.time() - meta['fetched'] < ttl):
+            instrument.record_http(meta['url'], meta['status_code'], 0, 0, from_cache=True)
+            return cached_response(meta['url'], meta['status_code'], content,
+                                   meta['headers'], True)
+        if self.offline:
+            raise LookupError('offline and not cached: ' + url)
+
+        headers = {}
+        if meta is not None:
+            if meta['headers'].get('ETag'):
+                headers['If-None-Match'] = meta['headers']['ETag']
+            if meta['headers'].get('Last-Modified'):
+                headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+        http = session if session is not None else requests
+        start = time.perf_counter()
+        r = http.get(url, params=params, headers=headers, timeout=timeout)
+        instrument.record_http(self.strip_private(r.url), r.status_code, len(r.content),
+                               time.perf_counter() - start)
+
+        if r.status_code == 304 and meta is not None:
+            meta['fetched'] = time.time()
+            self.write_entry(key, meta)
+            return cached_response(meta['url'], meta['status_code'], content,
+                                   meta['headers'], True)
+        response = cached_response(r.url, r.status_code, r.content, dict(r.headers), False)
+        if r.status_code == 200:
+            meta = {'url': self.strip_private(r.url), 'status_code': r.status_code,
+                    'fetched': time.time(),
+                    'headers': {h: r.headers[h] for h in ('ETag', 'Last-Modified', 'Content-Type')
+                                if h in r.headers}}
+            self.write_entry(key, meta, r.content)
+            self.add_bytes(len(r.content) - (len(content) if content is not None else 0))
+        return response
+
+    def strip_private(self, url):
+        """ url without private query parameters, safe to write to disk
+        """
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        items = [(k, v) for k, v in parse_qsl(query, keep_blank_values=True)
+                 if k not in private_params]
+        return urlunsplit((scheme, netloc, path, urlencode(items), fragment))
+
+def get_session(workers=1, retries=3):
+    """ requests.Session with a keep-alive connection pool sized for workers
+
+        Failed connections and 429/5xx responses are retried with backoff.
+    """
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET', 'HEAD'])
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1), max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def get_cache():
+    """ Get the process wide response cache configured from the environment
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = response_cache()
+    return _cache
+
+def set_cache(cache):
+    """ Replace the process wide response cache, ex: to point it at another directory
+    """
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+def get(url, params=None, session=None, timeout=None, ttl=None):
+    """ GET url through the process wide response cache. See response_cache.get
+    """
+    return get_cache().get(url, params=params, session=session, timeout=timeout, ttl=ttl)
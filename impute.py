@@ -0,0 +1,153 @@
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.decomposition import PCA
+from sklearn.impute import KNNImputer, SimpleImputer
+from sklearn.metrics.pairwise import nan_euclidean_distances
+from sklearn.neighbors import NearestNeighbors
+
+# imputation backends accepted by get_imputer
+imputer_methods = ['knn', 'chunked_knn', 'tree_knn', 'mean', 'iterative']
+
+def get_imputer(method='knn', **kwargs):
+    """ Get an imputer to use as the first step of a regression Pipeline
+
+        knn computes NaN aware distances from every row to every other row,
+        which is fine for ~3,100 counties but not for tracts or precincts.
+
+    Args:
+        method (str) one of
+            knn         sklearn KNNImputer
+            chunked_knn chunked_knn_imputer, NaN aware distances to a sample
+                        of donor rows, a chunk of rows at a time
+            tree_knn    tree_knn_imputer, neighbours from a ball tree over
+                        mean filled, PCA reduced rows
+            mean        column means
+            iterative   sklearn IterativeImputer
+        kwargs passed to the imputer
+
+    Returns:
+        sklearn transformer
+    """
+    if method == 'knn':
+        return KNNImputer(**kwargs)
+    if method == 'chunked_knn':
+        return chunked_knn_imputer(**kwargs)
+    if method == 'tree_knn':
+        return tree_knn_imputer(**kwargs)
+    if method == 'mean':
+        return SimpleImputer(strategy='mean', **kwargs)
+    if method == 'iterative':
+        from sklearn.experimental import enable_iterative_imputer
+        from sklearn.impute import IterativeImputer
+        return IterativeImputer(**kwargs)
+    raise Exception('imputer method must be one of ' + ', '.join(imputer_methods))
+
+def fill_from_neighbors(X, rows, neighbors, donors, col_means, n_neighbors, chunk_size=128):
+    """ Fill missing values of X[rows] with the mean of each row's neighbours
+
+        neighbors holds candidate donors per row, nearest first, -1 for none.
+        Like KNNImputer, each column is filled from the n_neighbors nearest
+        candidates that have it observed, so a row is never its own donor.
+        Columns missing in every candidate fall back to the column mean.
+    """
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        candidates = neighbors[i:i + chunk_size]
+        values = donors[candidates]
+        observed = ~np.isnan(values) & (candidates >= 0)[:, :, None]
+        use = observed & (np.cumsum(observed, axis=1) <= n_neighbors)
+        counts = use.sum(axis=1)
+        sums = np.where(use, values, 0).sum(axis=1)
+        fill = np.where(counts > 0, sums / np.maximum(counts, 1), col_means)
+        X[chunk] = np.where(np.isnan(X[chunk]), fill, X[chunk])
+
+class chunked_knn_imputer(BaseEstimator, TransformerMixin):
+    """ KNN imputation against a bounded sample of donor rows
+
+        Distances are NaN aware like KNNImputer, but each row is compared with
+        at most max_donors rows from fit, a chunk of rows at a time, so time
+        grows linearly with rows and memory with chunk_size * max_donors. Each
+        missing value is filled from the n_neighbors nearest of the
+        n_candidates nearest donors that have its column observed.
+
+        Example:
+            Pipeline([('imputer', chunked_knn_imputer()), ('ridge', RidgeCV(alphas))])
+    """
+    def __init__(self, n_neighbors=5, n_candidates=50, max_donors=5000, chunk_size=1024,
+                 random_state=0):
+        self.n_neighbors = n_neighbors
+        self.n_candidates = n_candidates
+        self.max_donors = max_donors
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        X = np.asarray(X, dtype=np.float64)
+        # like the sklearn imputers, columns with no observed values are dropped
+        self.observed_ = ~np.isnan(X).all(axis=0)
+        X = X[:, self.observed_]
+        self.col_means_ = np.nanmean(X, axis=0)
+        donors = X
+        if self.max_donors and len(X) > self.max_donors:
+            rng = np.random.default_rng(self.random_state)
+            donors = X[rng.choice(len(X), self.max_donors, replace=False)]
+        self.donors_ = donors
+        return self
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64)[:, self.observed_]
+        rows = np.flatnonzero(np.isnan(X).any(axis=1))
+        m = min(max(self.n_candidates, self.n_neighbors), len(self.donors_))
+        for i in range(0, len(rows), self.chunk_size):
+            chunk = rows[i:i + self.chunk_size]
+            dist = nan_euclidean_distances(X[chunk], self.donors_)
+            dist[np.isnan(dist)] = np.inf
+            neighbors = np.argpartition(dist, m - 1, axis=1)[:, :m]
+            # nearest first, donors sharing no observed column are not candidates
+            dist = np.take_along_axis(dist, neighbors, axis=1)
+            order = np.argsort(dist, axis=1, kind='stable')
+            neighbors = np.take_along_axis(neighbors, order, axis=1)
+            neighbors[np.isinf(np.take_along_axis(dist, order, axis=1))] = -1
+            fill_from_neighbors(X, chunk, neighbors, self.donors_, self.col_means_,
+                                self.n_neighbors)
+        return X
+
+class tree_knn_imputer(BaseEstimator, TransformerMixin):
+    """ Approximate KNN imputation with a ball tree
+
+        Rows are mean filled and projected to n_components with PCA, and
+        neighbours are found with a ball tree over the projected fit rows.
+        Each missing value takes the mean of the n_neighbors nearest of the
+        n_candidates nearest fit rows that have its column observed.
+
+        Example:
+            Pipeline([('imputer', tree_knn_imputer()), ('ridge', RidgeCV(alphas))])
+    """
+    def __init__(self, n_neighbors=5, n_candidates=50, n_components=10, random_state=0):
+        self.n_neighbors = n_neighbors
+        self.n_candidates = n_candidates
+        self.n_components = n_components
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        X = np.asarray(X, dtype=np.float64)
+        self.observed_ = ~np.isnan(X).all(axis=0)
+        X = X[:, self.observed_]
+        self.col_means_ = np.nanmean(X, axis=0)
+        self.donors_ = X
+        filled = np.where(np.isnan(X), self.col_means_, X)
+        self.pca_ = PCA(n_components=min(self.n_components, *X.shape),
+                        random_state=self.random_state).fit(filled)
+        m = min(max(self.n_candidates, self.n_neighbors), len(X))
+        self.tree_ = NearestNeighbors(n_neighbors=m, algorithm='ball_tree').fit(self.pca_.transform(filled))
+        return self
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64)[:, self.observed_]
+        rows = np.flatnonzero(np.isnan(X).any(axis=1))
+        if len(rows):
+            filled = np.where(np.isnan(X[rows]), self.col_means_, X[rows])
+            neighbors = self.tree_.kneighbors(self.pca_.transform(filled), return_distance=False)
+            fill_from_neighbors(X, rows, neighbors, self.donors_, self.col_means_,
+                                self.n_neighbors)
+        return X
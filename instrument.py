@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import atexit
+import resource
+import threading
+import functools
+
+# json lines trace file, tracing is off when unset
+trace_file = os.environ.get('PIPELINE_TRACE')
+
+# open trace file, counters and span stack per thread, set by enable
+_out = None
+_lock = threading.Lock()
+_counters = {}
+_local = threading.local()
+_page_size = os.sysconf('SC_PAGE_SIZE')
+
+class span:
+    """ Timed stage written to the trace as one json line when it ends
+
+        Records wall seconds, the enclosing span, RSS at the end of the span
+        and its change since the span started, and any attributes passed in or
+        added with set, ex: rows.
+
+        Example:
+            with instrument.span('acs.clean', groups=4) as s:
+                df = clean(df)
+                s.set(rows=len(df))
+    """
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start_rss_mb = get_rss_mb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _local.stack.pop()
+        rss_mb = get_rss_mb()
+        event = {'type': 'span', 'name': self.name, 'parent': self.parent,
+                 'seconds': round(seconds, 6), 'rss_mb': rss_mb,
+                 'rss_delta_mb': round(rss_mb - self.start_rss_mb, 1),
+                 'pid': os.getpid(), 'thread': threading.current_thread().name}
+        if exc_type is not None:
+            event['error'] = exc_type.__name__
+        event.update(self.attrs)
+        write_event(event)
+        return False
+
+class null_span:
+    """ Stand-in returned by get_span while tracing is off
+    """
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_null_span = null_span()
+
+def get_rss_mb():
+    """ Current resident set size of this process in MB, peak RSS where /proc is missing
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return get_max_rss_mb()
+    return round(pages * _page_size / 1024**2, 1)
+
+def get_max_rss_mb():
+    """ Peak resident set size of this process in MB
+    """
+    # ru_maxrss is in kilobytes on linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def write_event(event):
+    with _lock:
+        if _out is not None:
+            _out.write(json.dumps(event, default=str) + '\n')
+
+def enable(path=None):
+    """ Start writing trace events to path, appending, default PIPELINE_TRACE
+
+        Child processes inherit tracing through PIPELINE_TRACE.
+    """
+    global _out, trace_file
+    path = path or trace_file
+    if not path:
+        return
+    with _lock:
+        if _out is not None:
+            _out.close()
+        trace_file = path
+        os.environ['PIPELINE_TRACE'] = path
+        # line buffered, so processes appending to one file write whole lines
+        _out = open(path, 'a', buffering=1)
+    write_event({'type': 'start', 'pid': os.getpid(), 'time': time.time()})
+
+def disable():
+    """ Write counter totals and stop tracing
+    """
+    global _out
+    if _out is None:
+        return
+    with _lock:
+        counters = dict(_counters)
+        _counters.clear()
+    write_event({'type': 'counters', 'pid': os.getpid(), 'counters': counters,
+                 'max_rss_mb': get_max_rss_mb()})
+    with _lock:
+        _out.close()
+        _out = None
+
+def is_enabled():
+    return _out is not None
+
+def get_span(name, **attrs):
+    """ span(name, **attrs) while tracing, otherwise a shared no-op span
+    """
+    return span(name, **attrs) if _out is not None else _null_span
+
+def traced(name, rows=None):
+    """ Decorator running a function inside get_span(name)
+
+    Args:
+        name (str) span name
+        rows (function) called with the result to record a row count, ex: len
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _out is None:
+                return fn(*args, **kwargs)
+            with span(name) as s:
+                result = fn(*args, **kwargs)
+                if rows is not None:
+                    s.set(rows=rows(result))
+                return result
+        return wrapper
+    return decorator
+
+def count(name, value=1):
+    """ Add value to counter name, written with the totals when tracing stops
+    """
+    if _out is None:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def record_http(url, status_code, n_bytes, seconds, from_cache=False):
+    """ Count an HTTP response and write it to the trace
+
+    Args:
+        url         (str) request url, without private query parameters
+        status_code (int) response status
+        n_bytes     (int) body bytes downloaded
+        seconds     (float) request latency, 0 for cache hits
+        from_cache  (bool) True if the body was not downloaded
+    """
+    if _out is None:
+        return
+    with _lock:
+        for key, value in [('http.requests', 0 if from_cache else 1),
+                           ('http.cache_hits', 1 if from_cache else 0),
+                           ('http.bytes', n_bytes), ('http.seconds', seconds)]:
+            _counters[key] = _counters.get(key, 0) + value
+    write_event({'type': 'http', 'url': url, 'status_code': status_code, 'bytes': n_bytes,
+                 'seconds': round(seconds, 6), 'from_cache': from_cache,
+                 'pid': os.getpid(), 'thread': threading.current_thread().name})
+
+if trace_file:
+    enable(trace_file)
+atexit.register(disable)
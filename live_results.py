@@ -0,0 +1,255 @@
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import instrument
+from http_cache import get_session
+from county_fips import get_county_fips_index, save_county_fips_index
+from ddhq_scrape_county_returns import ddhq_scrape, ddhq_url, get_state_abbr
+
+# parties and offices of the shares in r_split_2020.get_party_votes_pe
+parties = ['Democratic', 'Republican']
+offices = ['President', 'US House']
+
+class live_results:
+    """ Party vote shares and r_pe_split kept current while counties report
+
+        Each poll revalidates every state payload with a conditional request
+        and only parses states whose payload changed. The votes dict of each
+        county in each President and US House race is compared with the last
+        snapshot, and only counties whose votes changed are added to the
+        running party and total votes of their fips. Shares and splits are
+        then recomputed for those fips alone, so a refresh costs the changed
+        states' payloads and the changed counties rather than the whole count.
+
+        Example:
+            live = live_results(['WI', 'MN'])
+            changed_states, delta = live.poll()
+            live.get_party_votes_pe()
+    """
+    def __init__(self, states, session=None, timeout=30, workers=8, base_url=ddhq_url,
+                 fips_index=None):
+        self.states = states
+        self.session = session if session is not None else get_session(workers)
+        self.timeout = timeout
+        self.workers = workers
+        self.base_url = base_url
+        self.fips_index = fips_index if fips_index is not None else get_county_fips_index()
+        self.payload_hashes = {} # state -> sha256 of its last parsed payload
+        self.county_votes = {}   # (state, race_id, ddhq county id) -> last votes dict
+        self.county_contrib = {} # (state, race_id, ddhq county id) -> (fips, office, votes vector)
+        self.county_fips = {}    # (state, ddhq county id) -> fips, None if unresolved
+        self.state_keys = {}     # state -> county_votes keys in its last payload
+        # fips -> int64 array of shape (office, party + total) of running votes
+        self.fips_votes = {}
+        self.polls = 0
+
+    def fetch_state(self, state):
+        """ Get the state payload if it changed since the last poll, else None
+        """
+        scrape = ddhq_scrape(session=self.session, timeout=self.timeout,
+                             base_url=self.base_url, fips_index=self.fips_index)
+        scrape.set_state_json(state, known_hash=self.payload_hashes.get(state))
+        if scrape.state_json == None:
+            return None
+        return scrape.state_json, scrape.state_hash
+
+    def resolve_counties(self, state, races):
+        """ Resolve fips of counties not seen before in one batch
+        """
+        new_counties = {}
+        for race, county_results in races:
+            for county in county_results:
+                if (state, county['id']) not in self.county_fips:
+                    new_counties[county['id']] = county['county']
+        if new_counties:
+            ids = list(new_counties)
+            fips = self.fips_index.resolve([state] * len(ids),
+                                           [new_counties[i] for i in ids], ids)
+            for county_id, county_fips in zip(ids, fips):
+                self.county_fips[(state, county_id)] = county_fips
+
+    def update_state(self, state, state_json):
+        """ Diff the county votes of a changed payload against the last snapshot
+
+        Returns:
+            set of fips whose votes changed
+        """
+        races = []
+        for race in state_json:
+            if race['office'] not in offices:
+                continue
+            try:
+                county_results = race['countyResults']
+            except KeyError:
+                county_results = race['vcuResults']
+            races.append((race, county_results['counties']))
+        self.resolve_counties(state, races)
+
+        changed = set()
+        seen = set()
+        for race, county_results in races:
+            office = offices.index(race['office'])
+            # vote dict keys are json strings, compare cand_ids as str
+            cand_party = {str(cand['cand_id']): parties.index(cand['party_name'])
+                          for cand in race['candidates'] if cand['party_name'] in parties}
+            for county in county_results:
+                key = (state, race['race_id'], county['id'])
+                seen.add(key)
+                if self.county_votes.get(key) == county['votes']:
+                    continue
+                self.county_votes[key] = county['votes']
+                vector = np.zeros(len(parties) + 1, dtype=np.int64)
+                for cand_id, votes in county['votes'].items():
+                    vector[-1] += votes
+                    if cand_id in cand_party:
+                        vector[cand_party[cand_id]] += votes
+                changed.update(self.set_contrib(key, (self.county_fips[(state, county['id'])],
+                                                      office, vector)))
+        # counties dropped from the payload no longer count
+        for key in self.state_keys.get(state, set()) - seen:
+            del self.county_votes[key]
+            changed.update(self.set_contrib(key, None))
+        self.state_keys[state] = seen
+        return changed
+
+    def set_contrib(self, key, contrib):
+        """ Replace the votes one county of one race adds to its fips
+
+        Returns:
+            list of fips whose votes changed
+        """
+        changed = []
+        old = self.county_contrib.pop(key, None)
+        for sign, update in [(-1, old), (1, contrib)]:
+            if update is None or update[0] is None:
+                continue
+            fips, office, vector = update
+            if fips not in self.fips_votes:
+                self.fips_votes[fips] = np.zeros((len(offices), len(parties) + 1), dtype=np.int64)
+            self.fips_votes[fips][office] += sign * vector
+            changed.append(fips)
+        if contrib is not None:
+            self.county_contrib[key] = contrib
+        return changed
+
+    def get_shares(self, fips):
+        """ Vote shares and r_pe_split for fips from the running votes
+
+        Returns:
+            pandas.DataFrame with the columns of r_split_2020.get_party_votes_pe,
+            NaN where a county has not reported an office
+        """
+        fips = list(fips)
+        votes = np.array([self.fips_votes[f] for f in fips], dtype=np.float64).reshape(
+            len(fips), len(offices), len(parties) + 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pe = votes[:, :, :len(parties)] / votes[:, :, len(parties)][:, :, np.newaxis]
+        df = pd.DataFrame({
+            'fips':       fips,
+            'd_pres_pe':  pe[:, 0, 0],
+            'r_pres_pe':  pe[:, 0, 1],
+            'd_house_pe': pe[:, 1, 0],
+            'r_house_pe': pe[:, 1, 1]})
+        df['r_pe_split'] = df['r_house_pe'] - df['r_pres_pe']
+        return df.replace([np.inf, -np.inf], np.nan)
+
+    def get_party_votes_pe(self):
+        """ Current shares of every reporting county, like r_split_2020.get_party_votes_pe
+        """
+        df = self.get_shares(sorted(self.fips_votes))
+        return df.dropna(axis=0).reset_index(drop=True)
+
+    def poll(self):
+        """ Fetch every state once and update the counties that changed
+
+        Returns:
+            tuple of (list of changed states, pandas.DataFrame of get_shares for
+            changed fips)
+        """
+        with instrument.get_span('live.poll', states=len(self.states)) as span:
+            with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor:
+                payloads = list(executor.map(self.fetch_state, self.states))
+            changed_states, changed_fips = [], set()
+            for state, payload in zip(self.states, payloads):
+                if payload is None:
+                    continue
+                state_json, state_hash = payload
+                with instrument.get_span('live.update', state=state) as update_span:
+                    state_fips = self.update_state(state, state_json)
+                    update_span.set(rows=len(state_fips))
+                self.payload_hashes[state] = state_hash
+                changed_states.append(state)
+                changed_fips.update(state_fips)
+            self.polls += 1
+            span.set(changed_states=len(changed_states), rows=len(changed_fips))
+        return changed_states, self.get_shares(sorted(changed_fips))
+
+    def run(self, feed=sys.stdout, interval=60, max_polls=None):
+        """ Poll every interval seconds, writing a json lines delta feed
+
+            Each poll writes one line per county whose shares changed, then a
+            poll line with the changed states and the poll's seconds.
+
+        Args:
+            feed      (file) open text file to write the feed to
+            interval  (float) seconds between the starts of polls
+            max_polls (int) stop after this many polls, default never
+        """
+        while max_polls is None or self.polls < max_polls:
+            start = time.perf_counter()
+            changed_states, delta = self.poll()
+            now = time.time()
+            for row in delta.to_dict('records'):
+                feed.write(json.dumps(dict({'type': 'county', 'poll': self.polls, 'time': now},
+                                           **{k: None if isinstance(v, float) and np.isnan(v) else v
+                                              for k, v in row.items()})) + '\n')
+            feed.write(json.dumps({'type': 'poll', 'poll': self.polls, 'time': now,
+                                   'changed_states': changed_states, 'changed_counties': len(delta),
+                                   'seconds': round(time.perf_counter() - start, 6)}) + '\n')
+            feed.flush()
+            if max_polls is not None and self.polls >= max_polls:
+                break
+            time.sleep(max(0, interval - (time.perf_counter() - start)))
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Poll DDHQ during the count and write county share and r_pe_split changes')
+    arg_parser.add_argument('--states', nargs='*', type=str,
+                            help='states to poll, default all')
+    arg_parser.add_argument('--interval', type=float, default=60,
+                            help='seconds between polls')
+    arg_parser.add_argument('--polls', type=int,
+                            help='stop after this many polls, default never')
+    arg_parser.add_argument('--feed', type=str,
+                            help='file to append the json lines delta feed to, default stdout')
+    arg_parser.add_argument('--workers', type=int, default=8,
+                            help='states to fetch in parallel')
+    arg_parser.add_argument('--timeout', type=float, default=30,
+                            help='seconds to wait on each state request')
+    arg_parser.add_argument('--retries', type=int, default=3,
+                            help='retries for failed state requests')
+    arg_parser.add_argument('--trace', type=str,
+                            help='append a json lines trace of stage timings and http calls. '
+                                 'same as setting PIPELINE_TRACE')
+    args = arg_parser.parse_args()
+    if args.trace:
+        instrument.enable(args.trace)
+
+    live = live_results(args.states or get_state_abbr(), session=get_session(args.workers, args.retries),
+                        timeout=args.timeout, workers=args.workers)
+    feed = open(args.feed, 'a') if args.feed else sys.stdout
+    try:
+        live.run(feed, args.interval, args.polls)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        save_county_fips_index()
+        if feed is not sys.stdout:
+            feed.close()
+
+if __name__ == '__main__':
+    main()
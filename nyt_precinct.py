@@ -5,25 +5,195 @@
 ##################################     Modules     ##################################
 #####################################################################################
 
-import geopandas as gpd
+import os
+import gzip
+import time
+import json
+import requests
+import numpy as np
 import pandas as pd
 import query_acs
-from sklearn.pipeline import Pipeline
-from sklearn.impute import KNNImputer
-from sklearn.linear_model import RidgeCV
+import instrument
 
 
 #####################################################################################
 ###########################     NYT Precinct Results     ############################
 #####################################################################################
 
-def get_precinct_results(curl_results=True):
+nyt_precincts_url = 'https://int.nyt.com/newsgraphics/elections/map-data/2020/national/precincts-with-results.geojson.gz'
+
+precinct_columns = ['GEOID', 'votes_dem', 'votes_rep', 'votes_total']
+
+@instrument.traced('nyt.download')
+def download_precinct_results(file_name='precincts-with-results.geojson.gz'):
+    """ Download the compressed NYT precinct results to file_name
+    """
+    start = time.perf_counter()
+    n_bytes = 0
+    with requests.get(nyt_precincts_url, stream=True) as r:
+        r.raise_for_status()
+        with open(file_name, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+                n_bytes += len(chunk)
+    instrument.record_http(nyt_precincts_url, r.status_code, n_bytes, time.perf_counter() - start)
+    return file_name
+
+def iter_precinct_features(file_name='precincts-with-results.geojson.gz',
+                           columns=precinct_columns, geometry=False,
+                           chunk_size=50000, read_size=4 * 1024 * 1024):
+    """ Stream GeoJSON features as column chunks
+
+        Reads .gz files directly and decodes one feature at a time, so memory
+        is bounded by chunk_size rows rather than the size of the file.
+        Without geometry only each feature's properties object is decoded and
+        coordinates are skipped unparsed.
+
+    Args:
+        file_name  (str)  path to .geojson or .geojson.gz file
+        columns    (list of str) feature properties to keep
+        geometry   (bool) include a geometry column
+        chunk_size (int)  features per chunk
+        read_size  (int)  characters read from the file at a time
+
+    Yields:
+        pandas.DataFrame with columns, or geopandas.GeoDataFrame if geometry.
+        A file without features yields one empty frame.
+    """
+    if geometry:
+        # geopandas and shapely are only loaded for geometry
+        import geopandas as gpd
+        import shapely.geometry
+    decoder = json.JSONDecoder()
+    opener = gzip.open if file_name.endswith('.gz') else open
+    chunk = {col: [] for col in columns}
+    shapes = []
+    n_chunks = 0
+
+    def to_frame():
+        df = pd.DataFrame(chunk, columns=columns)
+        if geometry:
+            df = gpd.GeoDataFrame(df, geometry=shapes, crs='EPSG:4326')
+        return df
+
+    with opener(file_name, 'rt', encoding='utf-8') as f:
+        buf = f.read(read_size)
+        eof = not buf
+        # without geometry only the properties objects are decoded, found by key
+        key = '"features"' if geometry else '"properties"'
+        pos = 0
+        while True:
+            start = buf.find(key, pos)
+            if start < 0:
+                if eof:
+                    break
+                more = f.read(read_size)
+                eof = not more
+                buf = buf[max(len(buf) - len(key), pos):] + more
+                pos = 0
+                continue
+            pos = start + len(key)
+            if geometry:
+                # features are decoded whole from the features array
+                bracket = buf.find('[', pos)
+                if bracket < 0:
+                    if eof:
+                        raise Exception('features array not found in ' + file_name)
+                    more = f.read(read_size)
+                    eof = not more
+                    buf = buf[start:] + more
+                    pos = 0
+                    continue
+                pos = bracket + 1
+                break
+            try:
+                # skip the colon and decode the properties object
+                value_start = buf.index(':', pos) + 1
+                while buf[value_start] in ' \t\r\n':
+                    value_start += 1
+                properties, pos = decoder.raw_decode(buf, value_start)
+            except (ValueError, IndexError):
+                if eof:
+                    raise
+                more = f.read(read_size)
+                eof = not more
+                buf = buf[start:] + more
+                pos = 0
+                continue
+            for col in columns:
+                chunk[col].append((properties or {}).get(col))
+            if len(chunk[columns[0]]) >= chunk_size:
+                yield to_frame()
+                n_chunks += 1
+                chunk = {col: [] for col in columns}
+        while geometry:
+            # skip separators between features
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) and buf[pos] == ']':
+                break
+            try:
+                feature, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(read_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            pos = end
+            properties = feature.get('properties') or {}
+            for col in columns:
+                chunk[col].append(properties.get(col))
+            shapes.append(shapely.geometry.shape(feature['geometry'])
+                          if feature.get('geometry') else None)
+            if len(chunk[columns[0]]) >= chunk_size:
+                yield to_frame()
+                n_chunks += 1
+                chunk = {col: [] for col in columns}
+                shapes = []
+    if chunk[columns[0]] or not n_chunks:
+        yield to_frame()
+
+@instrument.traced('nyt.read_precinct_results', rows=len)
+def read_precinct_results(file_name='precincts-with-results.geojson.gz',
+                          columns=precinct_columns, geometry=False):
+    """ Read NYT precinct results, see iter_precinct_features
+    """
+    return pd.concat(iter_precinct_features(file_name, columns, geometry), ignore_index=True)
+
+@instrument.traced('nyt.get_precinct_results', rows=len)
+def get_precinct_results(curl_results=True, assign_counties=False):
+    """ Get NYT 2020 presidential precinct results
+
+    Args:
+        curl_results    (bool) download results from nyt.com. The compressed
+                        file is read directly, see iter_precinct_features.
+        assign_counties (bool) assign counties to precincts by location with
+                        query_tiger.assign_geographies instead of the GEOID prefix.
+                        Precincts crossing county lines get the county with
+                        the largest overlap.
+
+    Returns:
+        pandas.DataFrame with columns PRECINCT_ID, fips, dem_advantage_pe
+    """
+    file_name = 'precincts-with-results.geojson.gz'
     if curl_results:
-        os.system("curl -O https://int.nyt.com/newsgraphics/elections/map-data/2020/national/precincts-with-results.geojson.gz")
-        os.system("gunzip precincts-with-results.geojson.gz")
+        download_precinct_results(file_name)
+    if not os.path.exists(file_name):
+        file_name = 'precincts-with-results.geojson'
 
-    precinct_results = gpd.read_file('precincts-with-results.geojson')
-    precinct_results['fips'] = precinct_results['GEOID'].str[:5]
+    # geometry is only needed to assign counties by location
+    precinct_results = read_precinct_results(file_name, geometry=assign_counties)
+    if assign_counties:
+        import query_tiger
+        counties = query_tiger.assign_geographies(precinct_results, 'COUNTY', year='2020',
+                                                  method='overlap')
+        precinct_results = precinct_results.merge(
+            counties.rename(columns={'tiger_GEOID': 'fips'}), on='GEOID', how='left')
+    else:
+        precinct_results['fips'] = precinct_results['GEOID'].str[:5]
     precinct_results.rename(columns={'GEOID': 'PRECINCT_ID'}, inplace=True)
 
     precinct_results['dem_vote_pe'] = precinct_results['votes_dem'] / precinct_results['votes_total']
@@ -37,17 +207,15 @@ def get_precinct_results(curl_results=True):
 #########################     American Community Survey     #########################
 #####################################################################################
 
+@instrument.traced('nyt.get_acs_vars', rows=len)
 def get_acs_vars(acs_groups):
-    acs_vars_list = []
-    for group in acs_groups:
-        acs_query = query_acs.query(year='2019', period='acs5', table='profile',
-                                    get_acs=group, for_acs='county', in_acs='state:*')
-        acs_query.select_acs_pe()
-        acs_vars_list.append(acs_query.acs_df)
-    acs_vars = query_acs.merge_acs_df(acs_vars_list)
-    acs_vars['fips'] = acs_vars.GEO_ID.str[-5:]
-    acs_vars.drop('GEO_ID', axis=1, inplace=True)
-    return acs_vars
+    catalog = query_acs.get_metadata_catalog('2019', 'acs5', 'profile')
+    pe_vars = [var for group in acs_groups
+               for var in catalog.get_group_vars(group.replace('group(', '').rstrip(')'))
+               if var.endswith('PE')]
+    acs_vars = query_acs.get_acs_vars(pe_vars, year='2019', period='acs5', table='profile',
+                                      for_acs='county', in_acs='state:*')
+    return query_acs.clean_acs_pe(acs_vars.reset_index(), id_cols=['fips'])
 
 
 #####################################################################################
@@ -63,4 +231,69 @@ def get_modeling_tables():
     y = modeling_df['dem_advantage_pe']
     return (X, y)
 
-X, y = get_modeling_tables()
\ No newline at end of file
+@instrument.traced('nyt.get_grouped_modeling_tables')
+def get_grouped_modeling_tables():
+    """ Precinct targets with county features kept once per county
+
+        Instead of copying every county's ACS columns onto each of its precincts,
+        precincts hold the row of their county in X_county.
+
+    Returns:
+        tuple of (X_county pandas.DataFrame indexed by fips, county_idx numpy
+        array of X_county rows for each precinct, y pandas.Series of
+        dem_advantage_pe per precinct)
+    """
+    acs_vars = get_acs_vars(
+        acs_groups=['group(DP02)','group(DP03)','group(DP04)','group(DP05)'])
+    X_county = acs_vars.set_index('fips')
+    precinct_results = get_precinct_results(curl_results=False)
+    precinct_results = precinct_results[precinct_results['fips'].isin(X_county.index)]
+    county_idx = X_county.index.get_indexer(precinct_results['fips'])
+    y = precinct_results['dem_advantage_pe'].reset_index(drop=True)
+    return (X_county, county_idx, y)
+
+@instrument.traced('nyt.fit_grouped_ridge')
+def fit_grouped_ridge(X_county, county_idx, y, alphas, imputer=None):
+    """ Fit imputer and ridge regression on precincts without repeating county rows
+
+        Every precinct in a county shares the county's features, so the precinct
+        level squared error equals the county level error of the mean precinct
+        target weighted by precinct count, plus a constant. The imputer runs once
+        per county and the ridge fits one weighted row per county.
+
+        For a given alpha the coefficients equal those of fitting the merged
+        table only if the imputer fills each county the same way from county
+        rows as from repeated precinct rows, ex: no missing values or a constant
+        fill. Mean and KNN imputers fit here weight every county once rather
+        than by precinct count, so their fills, and the coefficients, differ
+        slightly from imputing the merged table. RidgeCV picks alpha by
+        generalized cross validation over counties.
+
+    Args:
+        X_county   (pandas.DataFrame) county features
+        county_idx (numpy.array) X_county row of each precinct
+        y          (pandas.Series) precinct target
+        alphas     (list of float) ridge penalties to try
+        imputer    (sklearn transformer) default KNNImputer()
+
+    Returns:
+        sklearn.pipeline.Pipeline with fitted imputer and ridge steps
+    """
+    # sklearn is only loaded for fitting
+    from sklearn.pipeline import Pipeline
+    from sklearn.impute import KNNImputer
+    from sklearn.linear_model import RidgeCV
+    y = np.asarray(y, dtype=np.float64)
+    has_y = ~np.isnan(y)
+    counts = np.bincount(county_idx[has_y], minlength=len(X_county))
+    y_sum = np.bincount(county_idx[has_y], weights=y[has_y], minlength=len(X_county))
+    used = counts > 0
+    pipe = Pipeline([('imputer', imputer if imputer is not None else KNNImputer()),
+                     ('ridge', RidgeCV(alphas))])
+    instrument.count('impute.rows', int(used.sum()))
+    instrument.count('ridge.fits')
+    pipe.fit(X_county[used], y_sum[used] / counts[used], ridge__sample_weight=counts[used])
+    return pipe
+
+if __name__ == '__main__':
+    X, y = get_modeling_tables()
\ No newline at end of file
@@ -9,11 +9,28 @@
 #########################################################################################
 
 import os
-import requests
-import json
+import numpy as np
 import pandas as pd
+import threading
+import http_cache
+import instrument
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 
+# base url of the Census data API
+acs_base_url = 'https://api.census.gov/data/'
+
+# the Census API returns at most 50 variables per call, one is GEO_ID
+acs_batch_size = 49
+
+# directory of saved metadata catalogs
+catalog_dir = os.environ.get('ACS_CATALOG_DIR',
+                             os.path.join(os.path.expanduser('~'), '.cache', 'election_analysis', 'acs'))
+
+# catalogs loaded in this process, by (year, period, table)
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
 class query:
     def __init__(self, year=None, period=None, table=None, 
                  get_acs=None, for_acs=None, in_acs=None, 
@@ -31,7 +48,6 @@ class query:
         self.api_key = api_key # Census API key param
 
         # request results
-        self.acs_head = None # used to generate URL for requests.get
         self.acs_df   = None # dataframe to save as JSON
         self.metadata_df = pd.DataFrame(columns=['var', 'label', 'dtype', 'concept'])
  
@@ -40,12 +56,12 @@ class query:
         """
         base_list = [self.year, 'acs', self.period, self.table]
         base_list = [item for item in base_list if item]
-        self.acs_url = 'https://api.census.gov/data/' + '/'.join(base_list)
+        self.acs_url = acs_base_url + '/'.join(base_list)
           
-    def set_acs_head(self):
-        """ Send HEAD request to ACS API.
+    def set_acs_df(self): 
+        """ Save GET call as pandas.DataFrame.
 
-            This is an inexpensive request that will generate a URL for the GET call.
+            Responses are cached on disk, see http_cache.
         """
         if self.acs_url is None: self.set_acs_url()
         payload = {
@@ -53,35 +69,19 @@ class query:
             'for': self.for_acs,
             'in':  self.in_acs,
             'key': self.api_key}
-        self.acs_head = requests.head(self.acs_url, params=payload)
-
-    def set_acs_df(self): 
-        """ Save GET call as pandas.DataFrame.
-        """
-        if self.acs_head is None: self.set_acs_head()
-        r = requests.get(self.acs_head.url)
+        r = http_cache.get(self.acs_url, params=payload)
         self.acs_df = pd.DataFrame(r.json()[1:], columns=r.json()[0])
     
     def set_metadata_df(self):
         """ Get descriptive variale names and conceptss for ACS variables.
 
+            Reads from the saved metadata catalog, see get_metadata_catalog.
+
         Returns:
             pd.DataFrame with colums variable, label, dtype, concept
         """
-        if self.acs_url is None: self.set_acs_url()
-        vars_raw = requests.get(self.acs_url + '/variables.json')
-        vars_raw = vars_raw.json()['variables']
-        for var in vars_raw:
-            var_dict = vars_raw[var]
-            # not all variables have predicateType
-            try:
-                new_row = [[var, var_dict['label'], var_dict['predicateType'],
-                                        var_dict['concept']]]
-                self.metadata_df = self.metadata_df.append(
-                    pd.DataFrame(new_row, columns=self.metadata_df.columns), 
-                    ignore_index=True)
-            except KeyError:
-                pass
+        catalog = get_metadata_catalog(self.year, self.period, self.table)
+        self.metadata_df = catalog.get_metadata_df()
 
     def select_acs_pe(self):
         """ Select float percentage ACS variables
@@ -92,21 +92,189 @@ class query:
             I tried using metadata_df and selecting only float columns
             but many of the aggregate total variables are tagged as float.
         """
-        # keep only percentage and fips columns
-        # percentage fields end with 'PE'
         # GEO_ID contains county fips codes
         if self.acs_df is None: self.set_acs_df()
-        self.acs_df = self.acs_df.filter(regex='GEO_ID|PE$')
-        pe_vars = self.acs_df.columns.difference(['GEO_ID'])
-        self.acs_df[pe_vars] = self.acs_df[pe_vars].apply(pd.to_numeric)
-        # replace values not between 0-100 with None
-        self.acs_df[pe_vars] = self.acs_df[pe_vars].applymap(
-            lambda x: x if x>= 0 and x <= 100 else None)
-        # keep columns with no more than 10% missing values. 
-        # this should remove all columns that are not percentages
-        # and reduce the ammount of error introduced through imputation
-        # this method is a little hacky, but avoids having to study all acs variables
-        self.acs_df.dropna(axis=1, thresh=len(self.acs_df)/10, inplace=True)
+        self.acs_df = clean_acs_pe(self.acs_df, id_cols=['GEO_ID'])
+
+@instrument.traced('acs.clean_acs_pe', rows=len)
+def clean_acs_pe(acs_df, id_cols=['GEO_ID'], thresh=0.1, chunk_cols=64):
+    """ Keep ACS percentage variables as float32, nulling values outside 0-100
+
+        Census API values arrive as strings. They are parsed into one float32
+        array a block of columns at a time, so tract and block group pulls do
+        not need a float64 copy of the whole table.
+
+        Args:
+            acs_df     (pandas.DataFrame) ACS API query result
+            id_cols    (list of str) identifier columns to keep, ex: GEO_ID or fips
+            thresh     (float) keep columns with at least this fraction of values
+                       between 0 and 100
+            chunk_cols (int) columns parsed at a time
+        Returns:
+            pandas.DataFrame with id_cols and selected percentage variables
+    """
+    # keep only percentage and id columns
+    # percentage fields end with 'PE'
+    cols = [col for col in acs_df.columns if col in id_cols or col.endswith('PE')]
+    pe_vars = [col for col in cols if col not in id_cols]
+    values = np.empty((len(acs_df), len(pe_vars)), dtype=np.float32)
+    for i in range(0, len(pe_vars), chunk_cols):
+        block = acs_df[pe_vars[i:i + chunk_cols]].to_numpy(dtype=object)
+        block = np.where(np.equal(block, None), 'nan', block)
+        try:
+            values[:, i:i + chunk_cols] = block.astype(np.float32)
+        except (ValueError, TypeError):
+            # non numeric strings become NaN
+            values[:, i:i + chunk_cols] = pd.to_numeric(
+                block.ravel(), errors='coerce').reshape(block.shape)
+    # replace values not between 0-100 with NaN
+    values[~((values >= 0) & (values <= 100))] = np.nan
+    # keep columns with values in at least 10% of rows.
+    # this should remove all columns that are not percentages
+    # and reduce the ammount of error introduced through imputation
+    # this method is a little hacky, but avoids having to study all acs variables
+    keep = (~np.isnan(values)).sum(axis=0) >= len(acs_df) * thresh
+    pe_df = pd.DataFrame(values[:, keep], columns=np.array(pe_vars, dtype=object)[keep],
+                         index=acs_df.index)
+    acs_df = pd.concat([acs_df[[col for col in cols if col in id_cols]], pe_df], axis=1)
+    return acs_df[[col for col in cols if col in acs_df.columns]]
+
+class metadata_catalog:
+    """ Index of ACS variable metadata for one year, period and table
+
+        variables.json is parsed once into a table indexed by variable, with
+        label, dtype, concept and group. group, concept and dtype are stored as
+        categoricals. The table is saved to catalog_dir so later runs load it
+        without downloading or parsing variables.json.
+
+        Example:
+            catalog = get_metadata_catalog('2019', 'acs5', 'profile')
+            catalog.lookup(['DP02_0002PE', 'DP03_0009PE'])
+    """
+    def __init__(self, year=None, period=None, table=None, path=catalog_dir):
+        self.year   = year
+        self.period = period
+        self.table  = table
+        self.path   = path # directory of saved catalogs
+        self.vars_df = None # pandas.DataFrame indexed by var
+
+    def get_file_name(self):
+        base_list = [self.year, 'acs', self.period, self.table]
+        return os.path.join(self.path, '_'.join(item for item in base_list if item) + '.pkl')
+
+    @instrument.traced('acs.catalog')
+    def set_vars_df(self):
+        """ Load the saved catalog, or build and save it from variables.json
+        """
+        file_name = self.get_file_name()
+        if os.path.exists(file_name):
+            self.vars_df = pd.read_pickle(file_name)
+            return
+        acs_query = query(year=self.year, period=self.period, table=self.table)
+        acs_query.set_acs_url()
+        vars_raw = http_cache.get(acs_query.acs_url + '/variables.json').json()['variables']
+        vars_df = pd.DataFrame.from_dict(vars_raw, orient='index')
+        vars_df = vars_df.reindex(columns=['label', 'predicateType', 'concept', 'group'])
+        vars_df = vars_df.rename(columns={'predicateType': 'dtype'})
+        vars_df.index.name = 'var'
+        for col in ['dtype', 'concept', 'group']:
+            vars_df[col] = vars_df[col].astype('category')
+        self.vars_df = vars_df.sort_index()
+        os.makedirs(self.path, exist_ok=True)
+        self.vars_df.to_pickle(file_name)
+
+    def lookup(self, acs_vars):
+        """ Metadata for a list of variables
+
+            Args:
+                acs_vars (list of str) ACS variable names
+            Returns:
+                pandas.DataFrame with columns var, label, dtype, concept, group.
+                Unknown variables have missing metadata.
+        """
+        if self.vars_df is None: self.set_vars_df()
+        return self.vars_df.reindex(pd.Index(acs_vars, name='var')).reset_index()
+
+    def get_group_vars(self, group):
+        """ Variables in an ACS group, ex: DP02
+        """
+        if self.vars_df is None: self.set_vars_df()
+        return self.vars_df.index[self.vars_df['group'] == group].tolist()
+
+    def get_concept_vars(self, concept):
+        """ Variables with an ACS concept
+        """
+        if self.vars_df is None: self.set_vars_df()
+        return self.vars_df.index[self.vars_df['concept'] == concept].tolist()
+
+    def get_metadata_df(self):
+        """ All variables with a label, dtype and concept
+
+            Returns:
+                pd.DataFrame with colums var, label, dtype, concept
+        """
+        if self.vars_df is None: self.set_vars_df()
+        # not all variables have predicateType
+        metadata_df = self.vars_df.dropna(subset=['label', 'dtype', 'concept'])
+        return metadata_df.reset_index().filter(['var', 'label', 'dtype', 'concept'])
+
+def get_metadata_catalog(year=None, period=None, table=None):
+    """ Get the metadata_catalog for year, period and table, loaded once per process
+    """
+    with _catalogs_lock:
+        key = (year, period, table)
+        if key not in _catalogs:
+            _catalogs[key] = metadata_catalog(year, period, table)
+        return _catalogs[key]
+
+@instrument.traced('acs.get_acs_vars', rows=len)
+def get_acs_vars(acs_vars, year=None, period=None, table=None, for_acs=None, in_acs=None,
+                 api_key=os.environ.get('ACS_API_KEY'), workers=4, session=None):
+    """ Get a list of ACS variables in API sized batches fetched concurrently
+
+        Batches share one pooled session and the response cache, and are
+        assembled into a single frame by FIPS code.
+
+        Args:
+            acs_vars (list of str) ACS variables, ex: ['DP02_0002PE', 'DP03_0009PE']
+            year, period, table (str) see query
+            for_acs, in_acs (str) Census API for and in params, ex: 'county', 'state:*'
+            api_key  (str) Census API key
+            workers  (int) batches fetched at a time
+            session  (requests.Session) session to send requests with, optional
+        Returns:
+            pandas.DataFrame of str values indexed by fips, with a column per variable
+
+        Example:
+            get_acs_vars(['DP02_0002PE', 'DP03_0009PE'], '2019', 'acs5', 'profile',
+                         'county', 'state:*')
+    """
+    acs_query = query(year=year, period=period, table=table)
+    acs_query.set_acs_url()
+    acs_vars = list(dict.fromkeys(acs_vars))
+    batches = [acs_vars[i:i + acs_batch_size] for i in range(0, len(acs_vars), acs_batch_size)]
+    if session is None:
+        session = http_cache.get_session(workers)
+
+    def get_batch(batch):
+        payload = {
+            'get': ','.join(['GEO_ID'] + batch),
+            'for': for_acs,
+            'in':  in_acs,
+            'key': api_key}
+        with instrument.get_span('acs.fetch_batch', vars=len(batch)):
+            rows = http_cache.get(acs_query.acs_url, params=payload, session=session).json()
+        instrument.count('acs.fetched_rows', len(rows) - 1)
+        header = rows[0]
+        values = np.array(rows[1:], dtype=object).reshape(len(rows) - 1, len(header))
+        # GEO_ID is the summary level, 'US', then the fips code
+        fips = pd.Index(values[:, header.index('GEO_ID')], name='fips').str.split('US').str[-1]
+        return pd.DataFrame(values[:, [header.index(var) for var in batch]],
+                            index=fips, columns=batch)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        acs_df_list = list(executor.map(get_batch, batches))
+    return pd.concat(acs_df_list, axis=1)
 
 def merge_acs_df(acs_df_list=None):
     """ Merge American Community Survey API query dataframes.
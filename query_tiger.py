@@ -1,7 +1,24 @@
+import os
+import time
+import hashlib
+import threading
+import requests
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
+from io import StringIO
 from datetime import date 
-from functools import reduce
+from concurrent.futures import ThreadPoolExecutor
+import http_cache
+import instrument
+
+# base url of TIGER/Line shapefiles
+tiger_base_url = 'https://www2.census.gov/geo/tiger/'
+
+# directory of downloaded shapefile zips, versioned by year and geography
+tiger_cache_dir = os.environ.get('TIGER_CACHE_DIR',
+                                 os.path.join(os.path.expanduser('~'), '.cache', 'election_analysis', 'tiger'))
 
 # tiget_state_support_dict: whether or not each geographic level support state fips codes
 tiger_state_support_dict = {
@@ -18,13 +35,65 @@ tiger_state_support_dict = {
     'TABBLOCK20': True, 'TBG': False, 'TRACT': True, 'TTRACT': False, 'UAC':
     False, 'UNSD': True, 'ZCTA5': False}
 
-def get_tiger_shapes(geography=None, state_fips=None, year=str(date.today().year - 1)):
+# target shapes and their spatial index loaded in this process, by (geography, state_fips, year)
+_tiger_trees = {}
+_tiger_trees_lock = threading.Lock()
+
+def get_tiger_zip(url, file_name, session=None):
+    """ Download a TIGER zip to file_name, unless it is already cached
+
+        Returns:
+            file_name
+    """
+    if os.path.exists(file_name):
+        return file_name
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    http = session if session is not None else requests
+    start = time.perf_counter()
+    n_bytes = 0
+    with http.get(url, stream=True) as r:
+        r.raise_for_status()
+        tmp = file_name + '.part'
+        with open(tmp, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+                n_bytes += len(chunk)
+    instrument.record_http(url, r.status_code, n_bytes, time.perf_counter() - start)
+    os.replace(tmp, file_name)
+    return file_name
+
+@instrument.traced('tiger.read_zip', rows=len)
+def read_tiger_zip(file_name):
+    """ Read only the GEOID and geometry columns of a TIGER zip
+
+        Returns:
+            geopandas.GeoDataFrame with columns GEOID and geometry
+    """
+    try:
+        import pyogrio
+        fields = list(pyogrio.read_info(file_name)['fields'])
+        geoid = [field for field in fields if field.startswith('GEOID')][:1]
+        tiger_df = gpd.read_file(file_name, columns=geoid, engine='pyogrio')
+    except ImportError:
+        tiger_df = gpd.read_file(file_name)
+    tiger_df = tiger_df.filter(regex='GEOID|geometry', axis=1)
+    return tiger_df.rename(columns={tiger_df.columns[0]: 'GEOID'})
+
+@instrument.traced('tiger.get_tiger_shapes', rows=len)
+def get_tiger_shapes(geography=None, state_fips=None, year=str(date.today().year - 1),
+                     workers=4, cache_path=tiger_cache_dir):
     """ Get geographic shapes from census.gov
 
+        Zips are downloaded in parallel to cache_path and reused by later calls.
+        Per state zips outside state_fips are not downloaded.
+
         Args:
             geography (str) Geographic level. Available options here: https://www2.census.gov/geo/tiger/TIGER2020/2020_TL_Shapefiles_File_Name_Definitions.pdf
             state_fips (str) state fips code.
             year (str) year of shape file to return. Default previous year.
+            workers (int) zips downloaded at a time.
+            cache_path (str) directory of downloaded zips. Default TIGER_CACHE_DIR
+                environment variable.
         
         Returns:
             pandas.DataFrame with columns GEOID and geometry
@@ -34,17 +103,99 @@ def get_tiger_shapes(geography=None, state_fips=None, year=str(date.today().year
     """
     if not tiger_state_support_dict[geography] and state_fips:
         raise Exception('geography does not support state_fips')
-    tiger_df_list=[]
-    geo_tbl_url = 'https://www2.census.gov/geo/tiger/TIGER' + str(year) + '/' + geography.upper() + '/'
-    geo_zips = pd.read_html(geo_tbl_url)[0]['Name'].dropna()
-    geo_zips = (geo_zips[geo_zips.str.contains('.zip')])
+    geo_tbl_url = tiger_base_url + 'TIGER' + str(year) + '/' + geography.upper() + '/'
+    geo_tbl_html = http_cache.get(geo_tbl_url).text
+    geo_zips = pd.read_html(StringIO(geo_tbl_html))[0]['Name'].dropna()
+    geo_zips = (geo_zips[geo_zips.str.contains('.zip', regex=False)])
     if state_fips and any(geo_zips.str.contains(str(year)+'_'+state_fips)):
         geo_zips = geo_zips[geo_zips.str.contains('_'+state_fips+'_')].reset_index(drop=True)
-    for gz in geo_zips:
-        tiger_df = gpd.read_file(geo_tbl_url + gz).filter(regex='GEOID|geometry', axis=1)
-        tiger_df.rename(columns={tiger_df.columns[0]: 'GEOID'}, inplace=True)
-        tiger_df_list.append(tiger_df)
-    tiger_shapes = reduce(lambda x, y: pd.merge(x, y, on='GEOID'), tiger_df_list)
+
+    session = http_cache.get_session(workers)
+    def get_tiger_df(gz):
+        file_name = os.path.join(cache_path, 'TIGER' + str(year), geography.upper(), gz)
+        return read_tiger_zip(get_tiger_zip(geo_tbl_url + gz, file_name, session))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        tiger_df_list = list(executor.map(get_tiger_df, geo_zips))
+    # per state zips are disjoint, so stack them
+    tiger_shapes = pd.concat(tiger_df_list, axis=0, ignore_index=True)
     if state_fips: 
         return(tiger_shapes[tiger_shapes.GEOID.str.contains('^'+state_fips)].reset_index(drop=True))
     else: return tiger_shapes
+
+def get_tiger_tree(geography, state_fips=None, year=str(date.today().year - 1),
+                   cache_path=tiger_cache_dir):
+    """ Get TIGER shapes and an STRtree over their geometries, built once per process
+
+        Returns:
+            tuple of (geopandas.GeoDataFrame with columns GEOID and geometry, shapely.STRtree)
+    """
+    key = (geography.upper(), state_fips, str(year))
+    with _tiger_trees_lock:
+        if key not in _tiger_trees:
+            tiger_shapes = get_tiger_shapes(geography, state_fips, year, cache_path=cache_path)
+            _tiger_trees[key] = (tiger_shapes, shapely.STRtree(tiger_shapes.geometry.values))
+        return _tiger_trees[key]
+
+@instrument.traced('tiger.assign_geographies', rows=len)
+def assign_geographies(shapes, geography, state_fips=None, year=str(date.today().year - 1),
+                       method='point', id_col='GEOID', cache_path=tiger_cache_dir):
+    """ Assign shapes, ex: precincts, to the TIGER geography containing them
+
+        All shapes are matched in bulk against an STRtree over the target layer.
+        Assignments are saved under cache_path by layer and year, keyed by the
+        ids and bounds of shapes, so reruns on the same shapes read them back.
+
+        Args:
+            shapes (geopandas.GeoDataFrame) shapes to assign, with id_col and geometry
+            geography (str) TIGER geographic level, ex: 'COUNTY', 'TRACT', 'CD'
+            state_fips (str) state fips code, to load only one state's shapes
+            year (str) year of TIGER shapes. Default previous year.
+            method (str) 'point' assigns the geography containing a point inside
+                each shape. 'overlap' assigns the geography with the largest
+                intersection area.
+            id_col (str) column identifying shapes
+            cache_path (str) directory of TIGER zips and saved assignments
+
+        Returns:
+            pandas.DataFrame with columns id_col and tiger_GEOID, tiger_GEOID
+            missing for shapes outside the layer
+
+        Example:
+            assign_geographies(precincts, 'CD', '55', '2020', id_col='PRECINCT_ID')
+    """
+    if method not in ('point', 'overlap'):
+        raise Exception('method must be point or overlap')
+    bounds = pd.DataFrame(shapes.geometry.bounds.to_numpy().round(6))
+    # row hashes in order, so reordered shapes get their own assignment
+    row_hashes = pd.util.hash_pandas_object(
+        pd.concat([shapes[id_col].astype(str).reset_index(drop=True), bounds], axis=1),
+        index=False)
+    shapes_hash = hashlib.sha256(row_hashes.to_numpy().tobytes()).hexdigest()[:16]
+    file_name = os.path.join(cache_path, 'TIGER' + str(year), geography.upper(),
+                             'assignment_{}_{}_{}.pkl'.format(method, state_fips or 'us',
+                                                          shapes_hash))
+    if os.path.exists(file_name):
+        return pd.read_pickle(file_name)
+
+    tiger_shapes, tree = get_tiger_tree(geography, state_fips, year, cache_path)
+    geoms = shapes.geometry.to_crs(tiger_shapes.crs).values if tiger_shapes.crs else shapes.geometry.values
+    geoids = np.full(len(shapes), None, dtype=object)
+    if method == 'point':
+        shape_idx, tiger_idx = tree.query(shapely.point_on_surface(geoms), predicate='intersects')
+        # points on a shared border match both sides, keep the first
+        shape_idx, first = np.unique(shape_idx, return_index=True)
+        tiger_idx = tiger_idx[first]
+    else:
+        shape_idx, tiger_idx = tree.query(geoms, predicate='intersects')
+        area = shapely.area(shapely.intersection(geoms[shape_idx],
+                                                 tiger_shapes.geometry.values[tiger_idx]))
+        # largest intersection for each shape
+        order = np.lexsort((-area, shape_idx))
+        shape_idx, first = np.unique(shape_idx[order], return_index=True)
+        tiger_idx = tiger_idx[order][first]
+    geoids[shape_idx] = tiger_shapes['GEOID'].to_numpy()[tiger_idx]
+    # tiger_GEOID, so shape ids in a GEOID column are kept
+    assignment = pd.DataFrame({id_col: shapes[id_col].to_numpy(), 'tiger_GEOID': geoids})
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    assignment.to_pickle(file_name)
+    return assignment
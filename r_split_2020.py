@@ -1,31 +1,71 @@
 import os
-import requests
-from functools import reduce
+import argparse
 import pandas as pd
 import numpy as np
 import itertools
-import json
-from sklearn.pipeline import Pipeline
-from sklearn.impute import KNNImputer
-from sklearn.linear_model import RidgeCV
+import instrument
+import query_acs
+from stage_cache import stage_cache, get_file_hash
+from compact_results import compact_results
+from ddhq_scrape_county_returns import scrape_states, get_state_abbr, write_results
+from datetime import datetime
 
 
 #####################################################################################
 #############################     Election Results     ##############################
 #####################################################################################
-def scrape_ddhq_results(file_name):
+@instrument.traced('r_split.scrape_ddhq_results')
+def scrape_ddhq_results(file_name, states=None, workers=8):
     """ scrape county level election results from DDHQ and save to user's machine
+
+        Scrapes in this process with ddhq_scrape_county_returns.scrape_states.
         
         Args:
-            file_name (string) path to json file to save election results
+            file_name (string) path to json or parquet file to save election results
+            states    (list of str) state abbreviations, default get_state_abbr()
+            workers   (int) states fetched at a time
 
         Returns:
             0
     """
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    os.system('python ./ddhq_scrape_county_returns.py --dest ' + file_name)
+    ddhq_results = scrape_states(states or get_state_abbr(), workers=workers)
+    ddhq_results['datestamp'] = datetime.today().strftime("%Y%m%d")
+    write_results(ddhq_results, file_name)
     return 0
 
+@instrument.traced('r_split.read_results', rows=len)
+def read_results(file_name, columns, offices=None, parties=None):
+    """ Read columns of election results, keeping only some offices and parties
+
+        Parquet files are read with column projection and the office and party
+        filters pushed into the read. Json files are read whole and then filtered.
+        compact_results are expanded for just the columns and rows asked for.
+
+    Args:
+        file_name (str or compact_results) path to json or parquet file of
+        election results generated using ddhq_scrape_county_returns.py
+        columns   (list of str) columns to return
+        offices   (list of str) offices to keep, default all
+        parties   (list of str) parties to keep, default all
+
+    Returns:
+        pandas.DataFrame with columns
+    """
+    if isinstance(file_name, compact_results):
+        return file_name.to_frame(columns, offices, parties)
+    if file_name.endswith('.parquet'):
+        filters = []
+        if offices: filters.append(('office', 'in', offices))
+        if parties: filters.append(('party_name', 'in', parties))
+        df = pd.read_parquet(file_name, columns=columns, filters=filters or None)
+        for col in df.select_dtypes('category').columns:
+            df[col] = df[col].cat.remove_unused_categories()
+        return df
+    df = pd.read_json(file_name, dtype={'fips':'object'})
+    if parties: df = df[df['party_name'].isin(parties)]
+    if offices: df = df[df['office'].isin(offices)]
+    return df.filter(columns)
+
 def get_sparse_party_votes(file_name):
     """ Get Republican and Democratic US House and Presidential results
 
@@ -39,10 +79,8 @@ def get_sparse_party_votes(file_name):
     Returns:
         pandas.DataFrame with colums: fips, party_name, office, votes.
     """
-    df = pd.read_json(file_name, dtype={'fips':'object'})
-    df = df[df['party_name'].isin(['Democratic', 'Republican'])]
-    df = df[df['office'].isin(['President', 'US House'])]
-    df = df.filter(['fips', 'party_name', 'office', 'votes'])
+    df = read_results(file_name, ['fips', 'party_name', 'office', 'votes'],
+                      offices=['President', 'US House'], parties=['Democratic', 'Republican'])
     return df
 
 def fill_party_votes(sparse_party_votes):
@@ -64,9 +102,10 @@ def fill_party_votes(sparse_party_votes):
     df = pd.DataFrame(itertools.product(fips_uq, party_uq, office_uq), 
                       columns=['fips', 'party_name', 'office'])
     df = df.merge(sparse_party_votes, how='left')
-    df['votes'].fillna(0, inplace=True)
+    df['votes'] = df['votes'].fillna(0)
     return df
 
+@instrument.traced('r_split.get_party_votes', rows=len)
 def get_party_votes(file_name):
     """ Get Democratic and Republican House and Presidential votes for all counties
 
@@ -81,11 +120,12 @@ def get_party_votes(file_name):
     df = get_sparse_party_votes(file_name)
     df = fill_party_votes(df)
     df = df.pivot_table(values='votes', aggfunc='sum', index='fips',
-                        columns=['party_name', 'office'])
+                        columns=['party_name', 'office'], observed=True)
     df.columns = [' '.join(col).strip() for col in df.columns.values]
     df = df.reset_index()
     return df
 
+@instrument.traced('r_split.get_all_county_votes', rows=len)
 def get_all_county_votes(file_name):
     """ Calculate total votes in each county per office
 
@@ -96,37 +136,87 @@ def get_all_county_votes(file_name):
     Returns:
         pandas.DataFrame with columns fips, votes President, votes US House
     """
-    df = pd.read_json(file_name, dtype={'fips':'object'})
-    df = df[df['office'].isin(['President', 'US House'])]
-    df = df.filter(['fips', 'party_name', 'office', 'votes'])
-    df = df.groupby(['fips','office']).sum().reset_index()
+    df = read_results(file_name, ['fips', 'office', 'votes'],
+                      offices=['President', 'US House'])
+    df = df.groupby(['fips','office'], observed=True).sum().reset_index()
     df = df.pivot(index='fips', columns=['office']).reset_index()
     df.columns = [' '.join(col).strip() for col in df.columns.values]
     # not all counties report election results
     return df.dropna(axis=0)
 
+def aggregate_party_votes(df, parties=['Democratic', 'Republican'],
+                          offices=['President', 'US House']):
+    """ Sum party and total votes per county and office in one grouped reduction
+
+        fips, party_name and office are encoded as integer codes and all sums are
+        taken with a single bincount. Parties without a candidate in a county
+        get 0 votes. compact_results are already integer coded and skip the
+        encoding.
+
+    Args:
+        df      (pandas.DataFrame or compact_results) election results with
+                columns fips, party_name, office, votes
+        parties (list of str) parties to sum
+        offices (list of str) offices to sum
+
+    Returns:
+        tuple of (fips array, party votes array of shape (fips, office, party),
+        total votes array of shape (fips, office))
+    """
+    if isinstance(df, compact_results):
+        fips_uq, fips_codes, office_codes, party_codes, votes = df.get_codes(parties, offices)
+        office_codes, party_codes = office_codes.astype(np.int64), party_codes.astype(np.int64)
+        votes = votes.astype(np.float64)
+    else:
+        fips_codes, fips_uq = pd.factorize(df['fips'])
+        office_codes = pd.Categorical(df['office'], categories=offices).codes.astype(np.int64)
+        party_codes = pd.Categorical(df['party_name'], categories=parties).codes.astype(np.int64)
+        votes = df['votes'].to_numpy(dtype=np.float64)
+        keep = (fips_codes >= 0) & (office_codes >= 0)
+        fips_codes, office_codes = fips_codes[keep], office_codes[keep]
+        party_codes, votes = party_codes[keep], votes[keep]
+
+    # one slot per party plus one for the office total, for each fips and office
+    n_slots = len(parties) + 1
+    cell = (fips_codes * len(offices) + office_codes) * n_slots
+    in_party = party_codes >= 0
+    index = np.concatenate([cell + len(parties), cell[in_party] + party_codes[in_party]])
+    weights = np.concatenate([votes, votes[in_party]])
+    sums = np.bincount(index, weights=weights, minlength=len(fips_uq) * len(offices) * n_slots)
+    sums = sums.reshape(len(fips_uq), len(offices), n_slots)
+    return np.asarray(fips_uq), sums[:, :, :len(parties)], sums[:, :, len(parties)]
+
+@instrument.traced('r_split.get_party_votes_pe', rows=len)
 def get_party_votes_pe(file_name):
     """ Calculate Republican and Democratic US House and Presidential vote
-        percentages.
+        percentages, and Republican split ticket voting.
+
+        Reads the results once and aggregates them with aggregate_party_votes().
 
     Args:
-        file_name (str) path to json file of election results generated using
-        ddhq_scrape_county_returns.py
+        file_name (str or compact_results) path to json file of election
+        results generated using ddhq_scrape_county_returns.py
 
     Returns:
         pandas.DataFrame with columns fips, and Democratic and Republican, 
-        US House and Presidential vote percentage
+        US House and Presidential vote percentage, and r_pe_split
     """
-    party_votes = get_party_votes(file_name)
-    all_county_votes = get_all_county_votes(file_name)
-    df = party_votes.merge(all_county_votes)
-    df['d_pres_pe']  = df['Democratic President'] / df['votes President']
-    df['r_pres_pe']  = df['Republican President'] / df['votes President']
-    df['d_house_pe'] = df['Democratic US House']  / df['votes US House']
-    df['r_house_pe'] = df['Republican US House']  / df['votes US House']
-    df = df.filter(['fips', 'd_pres_pe', 'r_pres_pe', 'd_house_pe', 'r_house_pe'])
+    df = file_name if isinstance(file_name, compact_results) else \
+        read_results(file_name, ['fips', 'party_name', 'office', 'votes'],
+                     offices=['President', 'US House'])
+    fips, party_votes, total_votes = aggregate_party_votes(df)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pe = party_votes / total_votes[:, :, np.newaxis]
+    df = pd.DataFrame({
+        'fips':       fips,
+        'd_pres_pe':  pe[:, 0, 0],
+        'r_pres_pe':  pe[:, 0, 1],
+        'd_house_pe': pe[:, 1, 0],
+        'r_house_pe': pe[:, 1, 1]})
+    df['r_pe_split'] = df['r_house_pe'] - df['r_pres_pe']
     # ddhq does not have election results by party for all counties (ie: 12051)
-    return df.dropna(axis=0)
+    # counties missing an office have 0 total votes and NaN percentages
+    return df.dropna(axis=0).reset_index(drop=True)
 
 def get_r_pe_split(file_name):
     """ Calculate Republican split ticket voting
@@ -142,35 +232,74 @@ def get_r_pe_split(file_name):
         pandas.DataFrame with columns for fips and r_pe_split
     """
     df = get_party_votes_pe(file_name)
-    df['r_pe_split'] = df['r_house_pe'] - df['r_pres_pe']
     df = df.filter(['fips', 'r_pe_split'])
     return df.dropna(axis=1)
 
+@instrument.traced('r_split.get_split_targets', rows=len)
+def get_split_targets(file_name, parties=['Democratic', 'Republican'],
+                      office_pairs=[('US House', 'President')]):
+    """ Calculate split ticket and turnout drop-off targets for many parties
+        and office pairs from one read of the results
+
+        For each party and (office, other office) pair the split is the party's
+        percent vote for office minus its percent vote for other office, ex:
+        r_pe_split for Republicans in ('US House', 'President'). Drop-off is the
+        share of other office voters who did not vote for office. Targets for
+        pairs other than ('US House', 'President') get the office names as a
+        suffix, ex: d_pe_split_us_senate_president.
+
+    Args:
+        file_name    (str or compact_results) path to json or parquet file of
+        election results generated using ddhq_scrape_county_returns.py
+        parties      (list of str) parties to calculate splits for
+        office_pairs (list of tuple) (office, other office) pairs
+
+    Returns:
+        pandas.DataFrame with columns fips and one per target, for counties
+        reporting every office
+    """
+    offices = list(dict.fromkeys(office for pair in office_pairs for office in pair))
+    df = file_name if isinstance(file_name, compact_results) else \
+        read_results(file_name, ['fips', 'party_name', 'office', 'votes'], offices=offices)
+    fips, party_votes, total_votes = aggregate_party_votes(df, parties, offices)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pe = party_votes / total_votes[:, :, np.newaxis]
+        targets = {'fips': fips}
+        for office, other in office_pairs:
+            a, b = offices.index(office), offices.index(other)
+            suffix = '' if (office, other) == ('US House', 'President') else \
+                '_' + '_'.join([office, other]).lower().replace(' ', '_')
+            for p, party in enumerate(parties):
+                targets[party[0].lower() + '_pe_split' + suffix] = pe[:, a, p] - pe[:, b, p]
+            targets['dropoff_pe' + suffix] = 1 - total_votes[:, a] / total_votes[:, b]
+    # counties missing an office have 0 total votes and NaN or infinite targets
+    df = pd.DataFrame(targets).replace([np.inf, -np.inf], np.nan)
+    return df.dropna(axis=0).reset_index(drop=True)
+
 #####################################################################################
 #########################     American Community Survey     #########################
 #####################################################################################
-def get_acs_groups(groups, key):
+@instrument.traced('r_split.get_acs_groups', rows=len)
+def get_acs_groups(groups, key, pe_only=False):
     """ Get county level data from american community survey
 
+        Variables are listed from the metadata catalog and fetched in batches,
+        see query_acs.get_acs_vars.
+
     Args:
         groups       (list of str) acs api groups of fields to select
         key          (string)      census api key
+        pe_only      (bool)        fetch only percentage variables, ending with PE
     
     Returns:
         pandas.DataFrame with columns for fips and selected variables
     """
-    acs_df_list = []
-    for group in groups:
-        r = requests.get(
-            "https://api.census.gov/data/2019/acs/acs5/profile?get=group(" +
-            group +")&for=county&in=state:*&key=" + key)
-        df = pd.DataFrame(r.json()[1:], columns=r.json()[0])
-        # last 5 chars of GEO_ID are state and county fips codes
-        # it might be better to split this into another function
-        df['fips'] = df.GEO_ID.str[-5:]
-        df = df.drop('GEO_ID', axis=1)
-        acs_df_list.append(df)
-    return reduce(lambda x, y: pd.merge(x, y), acs_df_list)
+    catalog = query_acs.get_metadata_catalog('2019', 'acs5', 'profile')
+    acs_vars = [var for group in groups for var in catalog.get_group_vars(group)
+                if var.endswith('PE') or not pe_only]
+    df = query_acs.get_acs_vars(acs_vars, '2019', 'acs5', 'profile',
+                                for_acs='county', in_acs='state:*', api_key=key)
+    return df.reset_index()
 
 def get_acs_metadata():
     """ Get metadata for ACS 5 year profiles variables
@@ -181,24 +310,9 @@ def get_acs_metadata():
     Returns:
         pd.DataFrame with colulms variable, label, dtype, concept
     """
-    acs_metadata = pd.DataFrame(columns=['var', 'label', 'dtype', 'concept'])
-    vars_raw = requests.get(
-        'https://api.census.gov/data/2019/acs/acs5/profile/variables.json')
-    vars_raw = vars_raw.json()['variables']
-    for var in vars_raw:
-        var_dict = vars_raw[var]
-        # not all variables have predicateType
-        try:
-            new_row = [[var, var_dict['label'], var_dict['predicateType'],
-                                    var_dict['concept']]]
-            acs_metadata = acs_metadata.append(
-                pd.DataFrame(new_row, columns=acs_metadata.columns), 
-                ignore_index=True)
-        except KeyError:
-            pass
-        acs_metadata.append(new_row)
-    return acs_metadata
+    return query_acs.get_metadata_catalog('2019', 'acs5', 'profile').get_metadata_df()
 
+@instrument.traced('r_split.get_acs_pe', rows=len)
 def get_acs_pe(groups, key):
     """ Select float percentage ACS variables
         
@@ -215,20 +329,8 @@ def get_acs_pe(groups, key):
     Returns:
         pandas.DataFrame with columns for fips and selected ACS percentage variables
     """
-    df = get_acs_groups(groups, key)
-    # keep only percentage and fips columns
-    # percentage fields end with 'PE'
-    # GEO_ID contains county fips codes
-    df = df.filter(regex='PE$|fips')
-    non_fips = df.columns.difference(['fips'])
-    df[non_fips] = df[non_fips].apply(pd.to_numeric)
-    # replace values not between 0-100 with None
-    df[non_fips] = df[non_fips].applymap(lambda x: x if x>= 0 and x <= 100 else None)
-    # keep columns with no more than 10% missing values. 
-    # this should remove all columns that are not percentages
-    # and reduce the ammount of error introduced through imputation
-    # this method is a little hacky, but avoids having to study all acs variables
-    return df.dropna(axis=1, thresh=len(df)/10)
+    df = get_acs_groups(groups, key, pe_only=True)
+    return query_acs.clean_acs_pe(df, id_cols=['fips'])
 
 
 #####################################################################################
@@ -237,14 +339,20 @@ def get_acs_pe(groups, key):
 def get_modeling_tables(groups=['DP02','DP03','DP04','DP05'],
                         key=os.environ.get('ACS_API_KEY'), 
                         scrape_results=False, file_name=None):
-    """ 
+    """ Join county split ticket voting to ACS percentage variables
+
+    Args:
+        groups         (list of str) acs api groups of fields to select
+        key            (string) census api key
+        scrape_results (bool) scrape DDHQ results to file_name first
+        file_name      (str) path to election results
+
+    Returns:
+        tuple of (X pandas.DataFrame of ACS variables, y pandas.Series of r_pe_split)
     """
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    if scrape_results: scrape_ddhq_results(file_name) 
-    if not scrape_results and file_name not in os.listdir():
-        print('need election results, set scrape_results=True')
-        print()
-        sys.exit(1)
+    if scrape_results: scrape_ddhq_results(file_name)
+    if not os.path.exists(file_name):
+        raise Exception('need election results in ' + str(file_name) + ', set scrape_results=True')
     r_pe_split = get_r_pe_split(file_name)
     acs_vars = get_acs_pe(groups, key)
     acs_r_split = r_pe_split.merge(acs_vars).drop('fips', axis=1)
@@ -252,19 +360,193 @@ def get_modeling_tables(groups=['DP02','DP03','DP04','DP05'],
     y = acs_r_split['r_pe_split']
     return(X, y)
 
-# impute missing predictor values and fit and tune ridge regression
-# ridge regression will return coefficients for all predictors. This will allow us to 
-# understand how each variable impacted split ticket voting.
-# all predictors are percent variables, so no need to normalize x
-X, y = get_modeling_tables(scrape_results=True, file_name='election_results.json')
-alphas=(10**np.linspace(5, 3, 100)).tolist()
-pipe = Pipeline([('imputer', KNNImputer()), ('ridge', RidgeCV(alphas))])
-pipe.fit(X, y)
-
-# join ridge coefficients and acs metadata to access descriptive variable names
-ridge_coef = pd.DataFrame(zip(X.columns, pipe.named_steps.ridge.coef_),
-                          columns=['var', 'coef']) 
-acs_metadata = get_acs_metadata().filter(['var', 'label', 'concept'])
-ridge_coef = ridge_coef.merge(acs_metadata)
-
-ridge_coef.to_csv('r_split_acs_coef.csv')
+@instrument.traced('r_split.fit_split_models', rows=len)
+def fit_split_models(file_name, alphas, groups=['DP02','DP03','DP04','DP05'],
+                     key=os.environ.get('ACS_API_KEY'),
+                     parties=['Democratic', 'Republican'],
+                     office_pairs=[('US House', 'President')],
+                     min_counties=30, imputer='knn', workers=os.cpu_count()):
+    """ Fit ridge models of every split target nationally and for each state
+
+        Targets from get_split_targets share the ACS design matrix, so each
+        subset is imputed once and all targets are solved together, see
+        ridge.fit_subsets. States run in parallel processes.
+
+    Args:
+        file_name    (str) path to election results generated using
+        ddhq_scrape_county_returns.py
+        alphas       (list of float) ridge penalties to try
+        groups       (list of str) acs api groups of fields to select
+        key          (string) census api key
+        parties      (list of str) parties to calculate splits for
+        office_pairs (list of tuple) (office, other office) pairs
+        min_counties (int) skip states with fewer counties reporting
+        imputer      (str) imputer method, see impute.get_imputer
+        workers      (int) worker processes
+
+    Returns:
+        pandas.DataFrame with columns subset (US or state fips), target, rows,
+        alpha, var, coef
+    """
+    targets = get_split_targets(file_name, parties, office_pairs)
+    acs_vars = get_acs_pe(groups, key)
+    modeling_df = targets.merge(acs_vars)
+    X = modeling_df[acs_vars.columns.drop('fips')]
+    Y = modeling_df[targets.columns.drop('fips')]
+    subsets = {'US': np.arange(len(modeling_df))}
+    for state, rows in modeling_df.groupby(modeling_df['fips'].str[:2]).indices.items():
+        if len(rows) >= min_counties:
+            subsets[state] = rows
+    # sklearn is only loaded for fitting
+    import ridge
+    return ridge.fit_subsets(X, Y, subsets, alphas, imputer=imputer, workers=workers)
+
+def join_modeling_tables(splits, acs_pe, target='r_pe_split'):
+    """ Join split targets to ACS variables by county
+
+    Returns:
+        tuple of (X pandas.DataFrame of ACS variables, y pandas.Series of target)
+    """
+    modeling_df = splits.merge(acs_pe)
+    return (modeling_df[acs_pe.columns.drop('fips')], modeling_df[target])
+
+def annotate_coef(columns, coef):
+    """ Join ridge coefficients to ACS metadata for descriptive variable names
+
+    Returns:
+        pandas.DataFrame with columns var, coef, label, concept
+    """
+    ridge_coef = pd.DataFrame({'var': columns, 'coef': coef})
+    acs_metadata = query_acs.get_metadata_catalog('2019', 'acs5', 'profile')
+    acs_metadata = acs_metadata.lookup(ridge_coef['var']).filter(['var', 'label', 'concept'])
+    return ridge_coef.merge(acs_metadata)
+
+def impute_features(X, imputer):
+    """ Fill missing predictor values with impute.get_imputer(imputer)
+    """
+    import impute
+    instrument.count('impute.rows', len(X))
+    return impute.get_imputer(imputer).fit_transform(X)
+
+def fit_ridge_path(X, y, alphas):
+    """ Fit ridge.ridge_path over alphas
+    """
+    import ridge
+    instrument.count('ridge.fits')
+    return ridge.ridge_path(alphas).fit(X, y)
+
+def run_pipeline(file_name='election_results.json', groups=['DP02','DP03','DP04','DP05'],
+                 key=os.environ.get('ACS_API_KEY'), alphas=(10**np.linspace(5, 3, 100)).tolist(),
+                 imputer='knn', n_boot=0, workers=os.cpu_count(), cache=None):
+    """ Fit and annotate the ridge regression of r_pe_split on ACS variables
+
+        Runs the stages votes -> splits, acs -> clean, join -> impute -> fit ->
+        annotate, each memoized on disk by cache and keyed by its parameters
+        and inputs. The results file is keyed by its contents, so a new scrape
+        reruns everything, while a new alpha grid reruns only fit and annotate.
+
+    Args:
+        file_name (str) path to election results generated using
+                  ddhq_scrape_county_returns.py
+        groups    (list of str) acs api groups of fields to select
+        key       (string) census api key
+        alphas    (list of float) ridge penalties to try
+        imputer   (str) imputer method, see impute.get_imputer
+        n_boot    (int) bootstrap resamples for coefficient intervals, 0 for none
+        workers   (int) bootstrap worker processes
+        cache     (stage_cache) default stage_cache()
+
+    Returns:
+        tuple of (pandas.DataFrame of annotated coefficients, ridge.ridge_path)
+    """
+    # sklearn is only loaded for fitting
+    import ridge
+    cache = cache if cache is not None else stage_cache()
+    if not os.path.exists(file_name):
+        raise Exception('need election results in ' + str(file_name) + ', scrape them first')
+    votes = cache.run('votes', get_party_votes_pe, {'results': get_file_hash(file_name)}, file_name)
+    splits = cache.run('splits', lambda: votes.filter(['fips', 'r_pe_split']),
+                       {'target': 'r_pe_split'}, deps=[votes])
+    acs = cache.run('acs', get_acs_groups, {'groups': groups, 'year': '2019'},
+                    groups, key, pe_only=True)
+    acs_pe = cache.run('clean', query_acs.clean_acs_pe, {'thresh': 0.1}, acs,
+                       id_cols=['fips'], deps=[acs])
+    tables = cache.run('join', join_modeling_tables, {}, splits, acs_pe, deps=[splits, acs_pe])
+    X, y = tables
+    # impute missing predictor values once, then decompose once and score every alpha
+    X_imputed = cache.run('impute', impute_features, {'imputer': imputer}, X, imputer,
+                          deps=[tables])
+    path = cache.run('fit', fit_ridge_path, {'alphas': alphas}, X_imputed, y, alphas,
+                     deps=[X_imputed, tables])
+    ridge_coef = cache.run('annotate', annotate_coef, {}, X.columns, path.coef_, deps=[path])
+    if n_boot:
+        intervals = cache.run('bootstrap', ridge.bootstrap_ridge_path,
+                              {'n_boot': n_boot, 'imputer': imputer, 'alphas': alphas},
+                              X, y, alphas, n_boot=n_boot, imputer=imputer, workers=workers,
+                              deps=[tables])
+        ridge_coef = ridge_coef.assign(coef_lo=intervals[0], coef_hi=intervals[1],
+                                       sign_stability=intervals[2])
+    return (ridge_coef, path)
+
+def main():
+    # ridge regression will return coefficients for all predictors. This will allow us to
+    # understand how each variable impacted split ticket voting.
+    # all predictors are percent variables, so no need to normalize x
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--results', default='election_results.json',
+                            help='election results file, .json or .parquet')
+    arg_parser.add_argument('--scrape', action='store_true',
+                            help='scrape DDHQ results to --results first')
+    arg_parser.add_argument('--states', nargs='*', type=str,
+                            help='states to scrape, default all')
+    arg_parser.add_argument('--scrape-workers', type=int, default=8,
+                            help='states to fetch at a time')
+    arg_parser.add_argument('--groups', nargs='*', default=['DP02','DP03','DP04','DP05'],
+                            help='ACS profile groups')
+    arg_parser.add_argument('--alphas', nargs=3, type=float, default=[5, 3, 100],
+                            metavar=('START', 'STOP', 'NUM'),
+                            help='ridge penalties 10**linspace(START, STOP, NUM)')
+    arg_parser.add_argument('--imputer', default=os.environ.get('R_SPLIT_IMPUTER', 'knn'),
+                            help='knn, chunked_knn, tree_knn, mean or iterative, see impute.get_imputer')
+    arg_parser.add_argument('--bootstrap', type=int, default=int(os.environ.get('R_SPLIT_BOOTSTRAP', 0)),
+                            help='bootstrap resamples for coefficient intervals')
+    arg_parser.add_argument('--batch', action='store_true',
+                            default=os.environ.get('R_SPLIT_BATCH', '0') not in ('', '0', 'false'),
+                            help='also fit D and R splits and drop-off nationally and per state')
+    arg_parser.add_argument('--workers', type=int,
+                            default=int(os.environ.get('R_SPLIT_WORKERS', os.cpu_count())),
+                            help='worker processes for --bootstrap and --batch')
+    arg_parser.add_argument('--cache-dir', default=None,
+                            help='directory of memoized stage outputs, default STAGE_CACHE_DIR')
+    arg_parser.add_argument('--force', nargs='*', default=[],
+                            help='stages to rerun even if memoized, ex: acs fit')
+    arg_parser.add_argument('--out', default='r_split_acs_coef.csv')
+    arg_parser.add_argument('--trace', type=str,
+                            help='append a json lines trace, same as setting PIPELINE_TRACE')
+    args = arg_parser.parse_args()
+    if args.trace:
+        instrument.enable(args.trace)
+
+    if args.scrape:
+        # results change during the count, so scrapes are never memoized
+        scrape_ddhq_results(args.results, args.states, args.scrape_workers)
+    start, stop, num = args.alphas
+    alphas = (10**np.linspace(start, stop, int(num))).tolist()
+    cache = stage_cache(force=args.force) if args.cache_dir is None else \
+        stage_cache(args.cache_dir, force=args.force)
+    ridge_coef, path = run_pipeline(args.results, args.groups, alphas=alphas,
+                                    imputer=args.imputer, n_boot=args.bootstrap,
+                                    workers=args.workers, cache=cache)
+    ridge_coef.to_csv(args.out)
+    path.get_path_df(ridge_coef['var']).to_csv(os.path.splitext(args.out)[0] + '_path.csv', index=False)
+
+    if args.batch:
+        batch_coef = cache.run('batch', fit_split_models,
+                               {'results': get_file_hash(args.results), 'groups': args.groups,
+                                'alphas': alphas, 'imputer': args.imputer},
+                               args.results, alphas, groups=args.groups,
+                               imputer=args.imputer, workers=args.workers)
+        batch_coef.to_csv('r_split_batch_coef.csv', index=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.base import BaseEstimator, RegressorMixin
+from threadpoolctl import threadpool_limits
+import impute
+import instrument
+
+# design matrix and targets shared with worker processes, set by init_shared_worker
+_shared_X = None
+_shared_y = None
+
+class ridge_path(BaseEstimator, RegressorMixin):
+    """ Ridge regression over a whole grid of alphas from one SVD
+
+        X and y are centered and X decomposed once in fit. Coefficients and
+        generalized (leave one out) cross validation errors for every alpha
+        then cost a few matrix products on the stored decomposition, so the
+        same fit can be re-scored on a denser grid with set_alphas without
+        imputing or decomposing again. Picks the same alpha and coefficients
+        as RidgeCV(alphas) with its default GCV.
+
+        y may have one column per target. All targets share the decomposition
+        and each gets its own alpha, like RidgeCV(alphas, alpha_per_target=True).
+
+        Example:
+            path = ridge_path(alphas).fit(imputer.fit_transform(X), y)
+            path.coef_, path.get_path_df(X.columns)
+    """
+    def __init__(self, alphas=(0.1, 1.0, 10.0)):
+        self.alphas = alphas
+
+    def fit(self, X, y, sample_weight=None):
+        """ Center and decompose X, then score every alpha. See set_alphas
+        """
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        sw = np.ones(len(y)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        self.X_offset_ = np.average(X, axis=0, weights=sw)
+        self.y_offset_ = np.average(y, axis=0, weights=sw)
+        sqrt_sw = np.sqrt(sw)
+        X_c = (X - self.X_offset_) * sqrt_sw[:, None]
+        # targets are kept as columns, a single target as one column
+        self.y_c_ = (y - self.y_offset_).reshape(len(y), -1) * sqrt_sw[:, None]
+        self.multi_target_ = y.ndim > 1
+        # leverage of the unpenalized intercept
+        self.h_intercept_ = sw / sw.sum()
+        self.U_, self.s_, self.Vt_ = np.linalg.svd(X_c, full_matrices=False)
+        self.Uty_ = self.U_.T @ self.y_c_
+        return self.set_alphas(self.alphas)
+
+    def set_alphas(self, alphas):
+        """ Coefficient path and GCV errors for alphas from the fitted decomposition
+
+            Sets coef_path_ (alphas x features, or alphas x targets x features),
+            cv_errors_ (mean squared leave one out error per alpha, and target),
+            and alpha_, coef_ and intercept_ for the alpha with the smallest
+            error for each target.
+        """
+        self.alphas = alphas
+        alphas = np.asarray(alphas, dtype=np.float64)
+        n_rows, n_targets = self.y_c_.shape
+        s = self.s_[:, None]
+        shrink = s**2 / (s**2 + alphas)                    # components x alphas
+        # components x alphas x targets
+        coef_weights = (s / (s**2 + alphas))[:, :, None] * self.Uty_[:, None, :]
+        coef_path = np.einsum('kf,kat->atf', self.Vt_, coef_weights)
+        fitted = self.U_ @ (shrink[:, :, None] * self.Uty_[:, None, :]).reshape(len(s), -1)
+        fitted = fitted.reshape(n_rows, len(alphas), n_targets)
+        hat = (self.U_**2) @ shrink + self.h_intercept_[:, None]
+        loo = (self.y_c_[:, None, :] - fitted) / (1 - hat)[:, :, None]
+        cv_errors = (loo**2).mean(axis=0)                  # alphas x targets
+        best = np.argmin(cv_errors, axis=0)
+        targets = np.arange(n_targets)
+        coef = coef_path[best, targets]                    # targets x features
+        intercept = self.y_offset_ - coef @ self.X_offset_
+        if self.multi_target_:
+            self.coef_path_, self.cv_errors_ = coef_path, cv_errors
+            self.alpha_, self.best_score_ = alphas[best], -cv_errors[best, targets]
+            self.coef_, self.intercept_ = coef, intercept
+        else:
+            self.coef_path_, self.cv_errors_ = coef_path[:, 0], cv_errors[:, 0]
+            self.alpha_, self.best_score_ = alphas[best[0]], -cv_errors[best[0], 0]
+            self.coef_, self.intercept_ = coef[0], intercept[0]
+        return self
+
+    def predict(self, X):
+        return np.asarray(X, dtype=np.float64) @ self.coef_.T + self.intercept_
+
+    def get_path_df(self, columns=None, targets=None):
+        """ Long table of the coefficient path
+
+        Args:
+            columns (list of str) feature names, default feature positions
+            targets (list of str) target names of a multi target fit, default
+                    target positions
+
+        Returns:
+            pandas.DataFrame with columns alpha, cv_error, var, coef, and
+            target first for a multi target fit
+        """
+        coef_path = self.coef_path_.reshape(len(self.alphas), -1, self.coef_path_.shape[-1])
+        n_alphas, n_targets, n_features = coef_path.shape
+        columns = list(range(n_features)) if columns is None else list(columns)
+        df = pd.DataFrame({'alpha': np.repeat(np.asarray(self.alphas, dtype=np.float64),
+                                              n_targets * n_features),
+                           'cv_error': np.repeat(self.cv_errors_.ravel(), n_features),
+                           'var': columns * (n_alphas * n_targets),
+                           'coef': coef_path.ravel()})
+        if self.multi_target_:
+            targets = list(range(n_targets)) if targets is None else list(targets)
+            df.insert(0, 'target', np.tile(np.repeat(targets, n_features), n_alphas))
+        return df
+
+def init_shared_worker(X_path, y_path):
+    """ Open the memory mapped design matrix once per worker process
+    """
+    global _shared_X, _shared_y
+    _shared_X = np.load(X_path, mmap_mode='r')
+    _shared_y = np.load(y_path, mmap_mode='r')
+    # one BLAS thread per process, the pool supplies the parallelism
+    threadpool_limits(1)
+
+def fit_imputed(X, y, alphas, imputer, imputer_kwargs):
+    """ Impute and fit ridge_path on the columns of X with an observed value
+
+        Imputers drop columns missing in every row, ex: of a resample or a
+        state, so those columns are left out of the fit and get coefficient 0.
+
+    Returns:
+        tuple of (alpha_, coef_ with one entry per column of X)
+    """
+    observed = ~np.isnan(X).all(axis=0)
+    X = impute.get_imputer(imputer, **imputer_kwargs).fit_transform(X[:, observed])
+    path = ridge_path(alphas).fit(X, y)
+    coef = np.zeros(path.coef_.shape[:-1] + (len(observed),))
+    coef[..., observed] = path.coef_
+    return (path.alpha_, coef)
+
+def fit_bootstrap_batch(seeds, alphas, imputer, imputer_kwargs):
+    """ Impute and fit ridge_path on one resample per seed
+
+    Returns:
+        numpy.array of coefficients, one row per seed
+    """
+    coefs = []
+    for seed in seeds:
+        rows = np.random.default_rng(seed).integers(0, len(_shared_y), len(_shared_y))
+        coefs.append(fit_imputed(_shared_X[rows], _shared_y[rows], alphas, imputer,
+                                 imputer_kwargs)[1])
+    return np.array(coefs)
+
+def bootstrap_ridge_path(X, y, alphas, n_boot=200, imputer='knn', imputer_kwargs={},
+                         workers=os.cpu_count(), batch_size=10, level=0.95, seed=0):
+    """ Bootstrap intervals for imputer + ridge_path coefficients
+
+        Rows are resampled with replacement and each resample is imputed and
+        fit with its own GCV alpha, in a pool of worker processes. X and y are
+        written once to .npy files that the workers memory map, so tasks only
+        carry a batch of seeds.
+
+    Args:
+        X              (pandas.DataFrame or numpy.array) predictors, may hold NaN
+        y              (array) target
+        alphas         (list of float) ridge penalties to try
+        n_boot         (int)   number of resamples
+        imputer        (str)   imputer method, see impute.get_imputer
+        imputer_kwargs (dict)  passed to impute.get_imputer
+        workers        (int)   worker processes
+        batch_size     (int)   resamples per task
+        level          (float) interval coverage
+        seed           (int)   seed of the first resample
+
+    Returns:
+        tuple of (coef_lo, coef_hi, sign_stability) numpy arrays, where
+        sign_stability is the share of resamples agreeing with the sign of the
+        median coefficient
+    """
+    seeds = list(range(seed, seed + n_boot))
+    # counted here, worker processes exit without writing their counters
+    instrument.count('impute.rows', n_boot * len(y))
+    instrument.count('ridge.fits', n_boot)
+    batches = [seeds[i:i + batch_size] for i in range(0, n_boot, batch_size)]
+    with tempfile.TemporaryDirectory() as tmp:
+        X_path = os.path.join(tmp, 'X.npy')
+        y_path = os.path.join(tmp, 'y.npy')
+        np.save(X_path, np.asarray(X, dtype=np.float64))
+        np.save(y_path, np.asarray(y, dtype=np.float64))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_shared_worker,
+                                 initargs=(X_path, y_path)) as pool:
+            coefs = np.vstack(list(pool.map(fit_bootstrap_batch, batches,
+                                            [alphas] * len(batches),
+                                            [imputer] * len(batches),
+                                            [imputer_kwargs] * len(batches))))
+    tail = (1 - level) / 2 * 100
+    coef_lo, coef_hi = np.percentile(coefs, [tail, 100 - tail], axis=0)
+    sign_stability = (np.sign(coefs) == np.sign(np.median(coefs, axis=0))).mean(axis=0)
+    return (coef_lo, coef_hi, sign_stability)
+
+def fit_subset(rows, alphas, imputer, imputer_kwargs):
+    """ Impute and fit every target on the shared rows in one multi target solve
+
+        Columns missing in every row of the subset get coefficient 0.
+
+    Returns:
+        tuple of (alpha per target, coefficients of shape (targets, features))
+    """
+    return fit_imputed(_shared_X[rows], _shared_y[rows], alphas, imputer, imputer_kwargs)
+
+def fit_subsets(X, Y, subsets, alphas, imputer='knn', imputer_kwargs={},
+                workers=os.cpu_count()):
+    """ Fit multi target ridge_path models on row subsets in a process pool
+
+        Each subset, ex: the counties of one state, is imputed on its own and
+        all targets are solved from one decomposition of its rows. X and Y are
+        memory mapped by the workers like bootstrap_ridge_path.
+
+    Args:
+        X              (pandas.DataFrame) predictors, may hold NaN
+        Y              (pandas.DataFrame) one column per target, without NaN
+        subsets        (dict) subset name to array of row positions
+        alphas         (list of float) ridge penalties to try
+        imputer        (str)  imputer method, see impute.get_imputer
+        imputer_kwargs (dict) passed to impute.get_imputer
+        workers        (int)  worker processes
+
+    Returns:
+        pandas.DataFrame with columns subset, target, rows, alpha, var, coef
+    """
+    names = list(subsets)
+    # counted here, worker processes exit without writing their counters
+    instrument.count('impute.rows', sum(len(subsets[name]) for name in names))
+    instrument.count('ridge.fits', len(names))
+    with tempfile.TemporaryDirectory() as tmp:
+        X_path = os.path.join(tmp, 'X.npy')
+        y_path = os.path.join(tmp, 'y.npy')
+        np.save(X_path, np.asarray(X, dtype=np.float64))
+        np.save(y_path, np.asarray(Y, dtype=np.float64).reshape(len(Y), -1))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_shared_worker,
+                                 initargs=(X_path, y_path)) as pool:
+            fits = list(pool.map(fit_subset, [subsets[name] for name in names],
+                                 [alphas] * len(names), [imputer] * len(names),
+                                 [imputer_kwargs] * len(names)))
+    targets = list(Y.columns)
+    coef_dfs = []
+    for name, (alpha, coef) in zip(names, fits):
+        n_targets, n_features = coef.shape
+        coef_dfs.append(pd.DataFrame({
+            'subset': name,
+            'target': np.repeat(targets, n_features),
+            'rows':   len(subsets[name]),
+            'alpha':  np.repeat(alpha, n_features),
+            'var':    list(X.columns) * n_targets,
+            'coef':   coef.ravel()}))
+    return pd.concat(coef_dfs, ignore_index=True)
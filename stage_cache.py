@@ -0,0 +1,75 @@
+import os
+import json
+import pickle
+import hashlib
+import instrument
+
+# directory of memoized stage outputs, overridden with an environment variable
+cache_dir = os.environ.get('STAGE_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'election_analysis', 'stages'))
+
+def get_file_hash(file_name):
+    """ sha256 of a file's contents, to key stages that read it
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class stage_cache:
+    """ On-disk memo of pipeline stage outputs
+
+        A stage is keyed by its name, its parameters and the sha256 of the
+        pickled outputs of the stages it reads, so changing a parameter reruns
+        that stage and everything downstream of it whose input changed, while
+        upstream outputs are loaded from disk. A forced stage that returns new
+        output likewise reruns its downstream stages.
+
+        Example:
+            cache = stage_cache()
+            votes = cache.run('votes', get_party_votes_pe, {'results': get_file_hash(f)}, f)
+            splits = cache.run('splits', get_splits, {}, votes, deps=[votes])
+    """
+    def __init__(self, path=cache_dir, force=()):
+        self.path = path        # directory of pickled outputs
+        self.force = set(force) # stage names to rerun even if cached
+        self.outputs = {}       # id of each returned output -> (sha256 of its pickle, output)
+
+    def get_key(self, name, params, deps=()):
+        dep_keys = [self.outputs[id(dep)][0] for dep in deps]
+        key_json = json.dumps([name, params, dep_keys], sort_keys=True, default=str)
+        return hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+
+    def run(self, name, fn, params, *args, deps=(), **kwargs):
+        """ Load the output of stage name, or compute it with fn(*args, **kwargs)
+
+        Args:
+            name   (str)  stage name
+            fn     (function) computes the stage
+            params (dict) json serializable parameters that determine the output
+            deps   (list) outputs of earlier run calls this stage reads
+
+        Returns:
+            stage output
+        """
+        key = self.get_key(name, params, deps)
+        file_name = os.path.join(self.path, name + '_' + key[:16] + '.pkl')
+        with instrument.get_span('stage.' + name) as span:
+            if name not in self.force and os.path.exists(file_name):
+                with open(file_name, 'rb') as f:
+                    data = f.read()
+                output = pickle.loads(data)
+                span.set(cached=True)
+            else:
+                output = fn(*args, **kwargs)
+                data = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+                os.makedirs(self.path, exist_ok=True)
+                tmp = file_name + '.' + str(os.getpid())
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, file_name)
+                span.set(cached=False)
+        # outputs are kept so their ids are not reused while they key later stages
+        self.outputs[id(output)] = (hashlib.sha256(data).hexdigest(), output)
+        return output
@@ -0,0 +1,167 @@
+import csv
+import gzip
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.resources import files
+from urllib.parse import parse_qsl
+
+# Synthetic DDHQ payloads, NYT precinct files and a local http server for tests
+# and benchmarks.py. Only the standard library and addfips, so tests skip the
+# model stack.
+
+def get_county_names(state):
+    """ County names for a state from the addfips county file, so synthetic
+        payloads resolve to real fips codes
+    """
+    data = files('addfips').joinpath('data')
+    with data.joinpath('states.csv').open('rt', encoding='utf-8') as f:
+        statefp = {row['postal']: row['fips'] for row in csv.DictReader(f)}.get(state)
+    with data.joinpath('counties_2020.csv').open('rt', encoding='utf-8') as f:
+        return [row['name'] for row in csv.DictReader(f) if row['statefp'] == statefp]
+
+def make_ddhq_state_json(state, n_counties=80, n_races=4, n_cands=3, vcu=False, seed=0):
+    """ Build a synthetic DDHQ state payload
+
+        Mirrors the layout of the embeds.ddhq.io 2020 general results api.
+
+    Args:
+        state      (str)  state abbreviation
+        n_counties (int)  counties (or towns) per race
+        n_races    (int)  races in the state
+        n_cands    (int)  candidates per race
+        vcu        (bool) store results under vcuResults instead of countyResults
+        seed       (int)  random seed
+
+    Returns:
+        dict with race list stored under data
+    """
+    rng = random.Random(seed)
+    county_names = get_county_names(state) or ['County ' + str(n) for n in range(n_counties)]
+    offices = ['President', 'US House', 'US Senate', 'Governor']
+    parties = ['Democratic', 'Republican', 'Libertarian', 'Green']
+    races = []
+    for r in range(n_races):
+        race_id = rng.randint(1, 10**6)
+        cands = [{'cand_id': str(race_id * 10 + c),
+                  'party_name': parties[c % len(parties)],
+                  'first_name': 'First' + str(c),
+                  'last_name': 'Last' + str(c),
+                  'incumbent': c == 0} for c in range(n_cands)]
+        counties = [{'id': str(n),
+                     'county': county_names[n % len(county_names)],
+                     'votes': {cand['cand_id']: rng.randint(0, 50000) for cand in cands}}
+                    for n in range(n_counties)]
+        results_key = 'vcuResults' if vcu else 'countyResults'
+        races.append({'race_id': race_id,
+                      'office': offices[r % len(offices)],
+                      'abb': state,
+                      'candidates': cands,
+                      results_key: {'counties': counties}})
+    return {'data': races}
+
+
+def make_precinct_geojson(file_name, n_precincts=170000, vertices=40, seed=0):
+    """ Write a synthetic NYT precincts-with-results GeoJSON, gzipped if file_name ends with .gz
+
+        Precincts are small polygons laid out on a grid, each with GEOID and
+        vote properties like the NYT file.
+
+    Returns:
+        file_name
+    """
+    rng = random.Random(seed)
+    opener = gzip.open if file_name.endswith('.gz') else open
+    with opener(file_name, 'wt', encoding='utf-8') as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        for n in range(n_precincts):
+            x, y = -120 + (n % 1000) * 0.05, 30 + (n // 1000) * 0.05
+            ring = [[round(x + 0.02 * math.cos(2 * math.pi * v / vertices), 6),
+                     round(y + 0.02 * math.sin(2 * math.pi * v / vertices), 6)]
+                    for v in range(vertices)]
+            votes_dem, votes_rep = rng.randint(0, 2000), rng.randint(0, 2000)
+            feature = {'type': 'Feature',
+                       'properties': {'GEOID': '{:05d}-{}'.format(1001 + n // 50, n),
+                                      'votes_dem': votes_dem, 'votes_rep': votes_rep,
+                                      'votes_total': votes_dem + votes_rep + rng.randint(0, 100),
+                                      'votes_per_sqkm': 1.0, 'pct_dem_lead': 0.0},
+                       'geometry': {'type': 'Polygon', 'coordinates': [ring + ring[:1]]}}
+            f.write((',\n' if n else '') + json.dumps(feature))
+        f.write('\n]}\n')
+    return file_name
+
+
+class payload_server:
+    """ Local stand-in for the DDHQ api serving canned state payloads
+
+        Serves payloads[path] as json over keep-alive HTTP/1.1 connections from a
+        background thread. Responses carry an ETag and unchanged payloads answer
+        If-None-Match with 304. Assign to payloads while running to change them.
+        A callable payload is called with the dict of query parameters. bytes
+        payloads are served as files, str payloads as html and int payloads as
+        an empty response with that status code, ex: 503.
+
+        Example:
+            with payload_server({'/2020general_wi': payload}) as server:
+                scrape_states(['WI'], base_url=server.url + '/2020general_')
+    """
+    def __init__(self, payloads, latency=0):
+        self.payloads = payloads
+        self.latency  = latency # seconds to sleep before each response
+        self.requests = 0       # requests served
+        self.httpd    = None
+        self.url      = None
+
+    def __enter__(self):
+        server = self
+
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.latency)
+                path, _, query = self.path.partition('?')
+                payload = server.payloads.get(path)
+                if callable(payload):
+                    payload = payload(dict(parse_qsl(query)))
+                if payload is None or isinstance(payload, int):
+                    self.send_response(404 if payload is None else payload)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if isinstance(payload, bytes):
+                    body, content_type = payload, 'application/octet-stream'
+                elif isinstance(payload, str):
+                    body, content_type = payload.encode(), 'text/html'
+                else:
+                    body, content_type = json.dumps(payload).encode(), 'application/json'
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = 'http://127.0.0.1:' + str(self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
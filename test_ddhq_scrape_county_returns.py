@@ -0,0 +1,94 @@
+import copy
+import json
+import os
+import pandas as pd
+import pytest
+import http_cache
+from stand_in import make_ddhq_state_json, payload_server
+from ddhq_scrape_county_returns import ddhq_scrape, read_store, scrape_states, scrape_states_incremental
+
+states = ['WI', 'MN', 'IA']
+
+@pytest.fixture(autouse=True)
+def response_cache(tmp_path):
+    """ Cache responses in an empty directory for each test
+    """
+    http_cache.set_cache(http_cache.response_cache(path=str(tmp_path)))
+    yield
+    http_cache.set_cache(None)
+
+def get_payloads():
+    return {'/2020general_' + state.lower(): make_ddhq_state_json(state, 30, seed=i)
+            for i, state in enumerate(states)}
+
+def sort_results(df):
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+def test_workers_give_same_rows():
+    with payload_server(get_payloads()) as server:
+        base_url = server.url + '/2020general_'
+        serial = scrape_states(states, workers=1, base_url=base_url)
+        http_cache.set_cache(http_cache.response_cache(path=http_cache.get_cache().path + '_parallel'))
+        parallel = scrape_states(states, workers=4, base_url=base_url)
+    assert len(serial) == 3 * 4 * 30 * 3
+    pd.testing.assert_frame_equal(sort_results(serial), sort_results(parallel))
+
+def test_missing_state_is_skipped():
+    with payload_server(get_payloads()) as server:
+        results = scrape_states(states + ['ZZ'], workers=2, base_url=server.url + '/2020general_')
+    assert sorted(results['state_code'].unique()) == sorted(states)
+
+def test_server_error_is_retried():
+    payloads = get_payloads()
+    wi_payload = payloads['/2020general_wi']
+    calls = []
+
+    def flaky(params):
+        calls.append(params)
+        return 503 if len(calls) == 1 else wi_payload
+
+    payloads['/2020general_wi'] = flaky
+    with payload_server(payloads) as server:
+        results = scrape_states(['WI'], workers=1, retries=2, base_url=server.url + '/2020general_')
+    assert len(calls) == 2
+    assert len(results) == 4 * 30 * 3
+
+def test_store_parses_changed_states_only(tmp_path, monkeypatch):
+    store = str(tmp_path / 'store')
+    payloads = get_payloads()
+    parsed = []
+    set_ddhq_results_tbl = ddhq_scrape.set_ddhq_results_tbl
+
+    def count_parsed(self, state):
+        parsed.append(state)
+        return set_ddhq_results_tbl(self, state)
+
+    monkeypatch.setattr(ddhq_scrape, 'set_ddhq_results_tbl', count_parsed)
+    with payload_server(payloads) as server:
+        base_url = server.url + '/2020general_'
+        assert sorted(scrape_states_incremental(states, store, base_url=base_url)) == sorted(states)
+        with open(os.path.join(store, 'manifest.json')) as f:
+            first_manifest = json.load(f)
+        first = read_store(store)
+
+        assert scrape_states_incremental(states, store, base_url=base_url) == []
+        assert sorted(parsed) == sorted(states)
+
+        wi_payload = copy.deepcopy(payloads['/2020general_wi'])
+        county = wi_payload['data'][0]['countyResults']['counties'][0]
+        cand_id = next(iter(county['votes']))
+        county['votes'][cand_id] += 1000
+        payloads['/2020general_wi'] = wi_payload
+        assert scrape_states_incremental(states, store, base_url=base_url) == ['WI']
+        assert sorted(parsed) == sorted(states + ['WI'])
+
+    with open(os.path.join(store, 'manifest.json')) as f:
+        manifest = json.load(f)
+    assert sorted(manifest) == sorted(states)
+    assert manifest['WI']['hash'] != first_manifest['WI']['hash']
+    assert all(manifest[state] == first_manifest[state] for state in ['MN', 'IA'])
+    results = read_store(store)
+    assert len(results) == len(first) == 3 * 4 * 30 * 3
+    assert results['votes'].sum() == first['votes'].sum() + 1000
+    pd.testing.assert_frame_equal(sort_results(read_store(store, ['MN', 'IA'])),
+                                  sort_results(first[first['state_code'] != 'WI']))
@@ -0,0 +1,67 @@
+import os
+import pytest
+import http_cache
+from stand_in import payload_server
+
+def get_payloads():
+    return {'/a': b'a' * 1000, '/b': b'b' * 1000, '/c': b'c' * 1000}
+
+def test_fresh_entry_is_not_requested(tmp_path):
+    cache = http_cache.response_cache(path=str(tmp_path), ttl=60)
+    with payload_server(get_payloads()) as server:
+        first = cache.get(server.url + '/a')
+        second = cache.get(server.url + '/a')
+        assert server.requests == 1
+    assert not first.from_cache and second.from_cache
+    assert second.content == first.content == b'a' * 1000
+
+def test_stale_entry_is_revalidated(tmp_path):
+    cache = http_cache.response_cache(path=str(tmp_path), ttl=0)
+    payloads = get_payloads()
+    with payload_server(payloads) as server:
+        cache.get(server.url + '/a')
+        unchanged = cache.get(server.url + '/a')
+        payloads['/a'] = b'A' * 1000
+        changed = cache.get(server.url + '/a')
+        assert server.requests == 3
+    # an unchanged resource answers 304 and the cached body is returned
+    assert unchanged.from_cache and unchanged.status_code == 200
+    assert unchanged.content == b'a' * 1000
+    assert not changed.from_cache and changed.content == b'A' * 1000
+    meta, content = cache.read_entry(cache.get_key(server.url + '/a'))
+    assert content == b'A' * 1000
+
+def test_offline(tmp_path):
+    with payload_server(get_payloads()) as server:
+        http_cache.response_cache(path=str(tmp_path)).get(server.url + '/a')
+        cache = http_cache.response_cache(path=str(tmp_path), ttl=0, offline=True)
+        assert cache.get(server.url + '/a').content == b'a' * 1000
+        with pytest.raises(LookupError):
+            cache.get(server.url + '/b')
+        assert server.requests == 1
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = http_cache.response_cache(path=str(tmp_path), ttl=60, max_bytes=2500)
+    with payload_server(get_payloads()) as server:
+        urls = {path: server.url + path for path in get_payloads()}
+        cache.get(urls['/a'])
+        cache.get(urls['/b'])
+        # /b was used last, then /a is read from the cache
+        for path, mtime in [('/a', 1), ('/b', 2)]:
+            os.utime(cache.get_entry_path(cache.get_key(urls[path])) + '.body', (mtime, mtime))
+        assert cache.get(urls['/a']).from_cache
+        cache.get(urls['/c'])
+    assert cache.read_entry(cache.get_key(urls['/b'])) == (None, None)
+    assert cache.read_entry(cache.get_key(urls['/a']))[1] == b'a' * 1000
+    assert cache.read_entry(cache.get_key(urls['/c']))[1] == b'c' * 1000
+    assert cache.total_bytes == 2000
+
+def test_private_params_are_left_out(tmp_path):
+    cache = http_cache.response_cache(path=str(tmp_path), ttl=60)
+    assert (cache.get_key('https://api.census.gov/data?get=NAME', {'key': 'secret', 'for': 'county:*'}) ==
+            cache.get_key('https://api.census.gov/data?for=county:*&get=NAME&key=other'))
+    with payload_server(get_payloads()) as server:
+        cache.get(server.url + '/a', params={'key': 'secret', 'get': 'NAME'})
+        assert cache.get(server.url + '/a', params={'get': 'NAME'}).from_cache
+    meta, _ = cache.read_entry(cache.get_key(server.url + '/a', {'get': 'NAME'}))
+    assert 'secret' not in meta['url'] and 'get=NAME' in meta['url']
@@ -0,0 +1,32 @@
+import geopandas as gpd
+import pandas as pd
+import pytest
+from geopandas.testing import assert_geodataframe_equal
+from nyt_precinct import iter_precinct_features, precinct_columns, read_precinct_results
+from stand_in import make_precinct_geojson
+
+@pytest.fixture(scope='module')
+def precinct_file(tmp_path_factory):
+    file_name = str(tmp_path_factory.mktemp('nyt') / 'precincts-with-results.geojson.gz')
+    return make_precinct_geojson(file_name, n_precincts=60, vertices=6)
+
+@pytest.mark.parametrize('read_size', [7, 64, 4096])
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000])
+def test_reader_matches_read_file(precinct_file, read_size, chunk_size):
+    expected = gpd.read_file('/vsigzip/' + precinct_file)[precinct_columns + ['geometry']]
+    chunks = list(iter_precinct_features(precinct_file, chunk_size=chunk_size, read_size=read_size))
+    assert all(len(chunk) <= chunk_size for chunk in chunks)
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True),
+                                  pd.DataFrame(expected[precinct_columns]), check_dtype=False)
+    shapes = pd.concat(iter_precinct_features(precinct_file, geometry=True, chunk_size=chunk_size,
+                                              read_size=read_size), ignore_index=True)
+    assert_geodataframe_equal(shapes, expected, check_dtype=False)
+
+@pytest.mark.parametrize('geometry', [False, True])
+def test_no_features(tmp_path, geometry):
+    file_name = str(tmp_path / 'precincts-with-results.geojson')
+    with open(file_name, 'w') as f:
+        f.write('{"type": "FeatureCollection", "features": []}')
+    df = read_precinct_results(file_name, geometry=geometry)
+    assert len(df) == 0
+    assert list(df.columns) == precinct_columns + (['geometry'] if geometry else [])
@@ -0,0 +1,72 @@
+from stage_cache import stage_cache, get_file_hash
+
+class counted:
+    """ Stage function that records its calls
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.fn(*args)
+
+def run_pipeline(cache, scale, offset=0):
+    votes = cache.run('votes', scale_votes, {'scale': scale}, scale)
+    shares = cache.run('shares', get_shares, {}, votes, deps=[votes])
+    return cache.run('splits', add_offset, {'offset': offset}, shares, offset, deps=[shares])
+
+scale_votes = counted(lambda scale: [scale * v for v in [1, 2, 3, 4]])
+get_shares = counted(lambda votes: [v / sum(votes) for v in votes])
+add_offset = counted(lambda shares, offset: [s + offset for s in shares])
+
+def reset_calls():
+    for fn in [scale_votes, get_shares, add_offset]:
+        fn.calls = 0
+
+def get_calls():
+    return [fn.calls for fn in [scale_votes, get_shares, add_offset]]
+
+def test_cached_stages_are_loaded(tmp_path):
+    reset_calls()
+    first = run_pipeline(stage_cache(str(tmp_path)), 1)
+    second = run_pipeline(stage_cache(str(tmp_path)), 1)
+    assert first == second == [0.1, 0.2, 0.3, 0.4]
+    assert get_calls() == [1, 1, 1]
+
+def test_changed_params_rerun_downstream(tmp_path):
+    reset_calls()
+    run_pipeline(stage_cache(str(tmp_path)), 1)
+    run_pipeline(stage_cache(str(tmp_path)), 1, offset=1)
+    assert get_calls() == [1, 1, 2]
+    # scaling changes the votes but not the shares, so splits are loaded
+    assert run_pipeline(stage_cache(str(tmp_path)), 2) == [0.1, 0.2, 0.3, 0.4]
+    assert get_calls() == [2, 2, 2]
+
+def test_force_reruns_downstream_of_changed_output(tmp_path):
+    reset_calls()
+    run_pipeline(stage_cache(str(tmp_path)), 1)
+    # forced stage with the same output leaves downstream stages cached
+    run_pipeline(stage_cache(str(tmp_path), force=['votes']), 1)
+    assert get_calls() == [2, 1, 1]
+
+    # votes changed since they were cached, ex: a code change, so forcing reruns downstream
+    scale_votes.fn = lambda scale: [scale * v for v in [4, 3, 2, 1]]
+    try:
+        splits = run_pipeline(stage_cache(str(tmp_path), force=['votes']), 1)
+    finally:
+        scale_votes.fn = lambda scale: [scale * v for v in [1, 2, 3, 4]]
+    assert splits == [0.4, 0.3, 0.2, 0.1]
+    assert get_calls() == [3, 2, 2]
+    # the forced output replaced the cached one, so later runs load it and its downstream
+    assert run_pipeline(stage_cache(str(tmp_path)), 1) == [0.4, 0.3, 0.2, 0.1]
+    assert get_calls() == [3, 2, 2]
+
+def test_file_hash_follows_contents(tmp_path):
+    file_name = str(tmp_path / 'results.json')
+    with open(file_name, 'w') as f:
+        f.write('[1, 2]')
+    first = get_file_hash(file_name)
+    with open(file_name, 'w') as f:
+        f.write('[1, 3]')
+    assert get_file_hash(file_name) != first